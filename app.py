@@ -1,10 +1,19 @@
 import streamlit as st
-import json
 import pandas as pd
-import os
-from backend.categorizer import categorizer
-from backend.agent import get_agent_response
+from backend.jobs import jobs, start_categorization, start_drafts
+from backend.drafter import DEFAULT_CATEGORIES, parse_draft, select_positions
+from backend.agent import stream_agent_response
+from backend.store import get_store
+from backend.mailboxes import DEFAULT, create_mailbox, list_mailboxes, set_mailbox
+from backend.emailtable import get_email_table
+from backend.datacache import cached
+from backend.responsecache import response_cache
+from backend.history import HistoryManager
+from backend.metrics import metrics
+from backend.scheduler import scheduler
+from backend.tasks import UPCOMING_DAYS, by_sender, due_today, overdue, upcoming
 import uuid
+from datetime import date
 
 # Set page configuration
 st.set_page_config(page_title="Email Productivity Agent", layout="wide")
@@ -13,33 +22,154 @@ st.set_page_config(page_title="Email Productivity Agent", layout="wide")
 if 'page' not in st.session_state:
     st.session_state.page = "Home"
 
-# File paths
-INBOX_PATH = 'sources/inbox.json'
-PROCESSED_PATH = 'sources/processed_inbox.json'
-PROMPTS_PATH = 'sources/prompts.json'
-DRAFTS_PATH = 'sources/drafts.json'
-
-def load_data(path):
-    if os.path.exists(path):
-        try:
-            with open(path, 'r') as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            st.error(f"Error decoding JSON from {path}")
-            return None
-    else:
-        st.warning(f"File not found: {path}")
+# state of the page that belongs to one mailbox
+MAILBOX_STATE = ("messages", "history", "show_inbox", "show_processed", "categorize_job", "drafts_job")
+
+def switch_mailbox():
+    for key in MAILBOX_STATE:
+        st.session_state.pop(key, None)
+
+def new_mailbox():
+    name = st.session_state.new_mailbox.strip()
+    try:
+        create_mailbox(name)
+    except (ValueError, OSError) as e:
+        st.session_state.mailbox_error = str(e)
+        return
+    st.session_state.mailbox_error = None
+    st.session_state.mailbox = name
+    switch_mailbox()
+
+# Mailbox picker: every mailbox has its own inbox, prompts, processed emails and drafts
+with st.sidebar:
+    mailboxes = list_mailboxes()
+    if st.session_state.get("mailbox") not in mailboxes:
+        st.session_state.mailbox = DEFAULT
+    st.selectbox("📂 Mailbox", mailboxes, key="mailbox", on_change=switch_mailbox)
+    with st.expander("New Mailbox", expanded=False):
+        st.text_input("Name", key="new_mailbox", placeholder="e.g. sales")
+        st.button("Create Mailbox", on_click=new_mailbox)
+        if st.session_state.get("mailbox_error"):
+            st.error(st.session_state.mailbox_error)
+set_mailbox(st.session_state.mailbox)
+
+# Mailbox storage (the JSON files of the mailbox are imported into it whenever they change)
+store = get_store()
+
+def load_data(table, read, *args, **kwargs):
+    # served from memory until the database or the JSON file behind `table` changes
+    key = (store.path, read.__name__, args, tuple(sorted(kwargs.items())))
+    try:
+        return cached(key, store.signature(table), lambda: read(*args, **kwargs))
+    except Exception as e:
+        st.error(f"Error loading data: {e}")
         return None
 
-def save_data(path, data):
+PAGE_SIZES = [10, 25, 50, 100]
+# selectors only list this many matches, type in the search box to narrow them down
+SELECT_LIMIT = 50
+
+def paginate(name, total):
+    # renders the page controls and returns (limit, offset) for the store query
+    col1, col2, col3 = st.columns([1, 1, 2])
+    with col1:
+        page_size = st.selectbox("Page size", PAGE_SIZES, key=f"{name}_page_size")
+    pages = max(1, -(-total // page_size))
+    with col2:
+        page = st.number_input("Page", min_value=1, max_value=pages, value=1, step=1, key=f"{name}_page")
+    with col3:
+        st.caption(f"{total} emails, page {page} of {pages}")
+    return page_size, (page - 1) * page_size
+
+def email_table():
+    # the shared columnar table of processed emails, reloaded only when they change
     try:
-        with open(path, 'w') as f:
-            json.dump(data, f, indent=4)
+        return get_email_table()
+    except Exception as e:
+        st.error(f"Error loading data: {e}")
+        return None
+
+def email_selector(label, key, allow_none=None):
+    # searched in the shared email table, only the matching emails become options
+    search = st.text_input(f"Search {label.lower()}", key=f"{key}_search", placeholder="Subject or sender")
+    table = email_table()
+    positions = table.select(search=search or None)[:SELECT_LIMIT] if table is not None else []
+    matches = table.records(positions) if len(positions) else []
+    email_options = ([allow_none] if allow_none else []) + [f"{i+1}. {e.get('subject')} | {e.get('sender')}" for i, e in enumerate(matches)]
+    selected_option = st.selectbox(label, email_options, key=key)
+    if len(matches) == SELECT_LIMIT:
+        st.caption(f"Showing the first {SELECT_LIMIT} matches.")
+    if not selected_option or selected_option == allow_none:
+        return None
+    index = int(selected_option.split('.')[0]) - 1
+    # only the chosen email is read with its body
+    return table.email(positions[index])
+
+# tasks listed per view, the rest is counted
+TASK_LIMIT = 100
+
+def task_list(tasks, empty_message):
+    if not tasks:
+        st.info(empty_message)
+        return
+    for task in tasks[:TASK_LIMIT]:
+        due = f"**{task['deadline']}** · " if task["deadline"] else ""
+        st.markdown(f"- {due}{task['text']}  \n  _{task['sender_name'] or task['sender']} (`{task['sender']}`) · {task['subject']}_")
+    if len(tasks) > TASK_LIMIT:
+        st.caption(f"Showing {TASK_LIMIT} of {len(tasks)} tasks.")
+
+def save_data(write, *args):
+    try:
+        write(*args)
         return True
     except Exception as e:
         st.error(f"Error saving data: {e}")
         return False
 
+def job_progress(key, label, name, done_message, columns, show_flag=None):
+    """
+    Live view of the background job whose id is in st.session_state[key] (see backend.jobs),
+    reloading the page once it is finished. Nothing is rendered, and nothing polls, without a job.
+    """
+    job = jobs.get(st.session_state.get(key))
+    if job is None:
+        st.session_state.pop(key, None)
+        return
+    _job_poller(job, key, label, name, done_message, columns, show_flag)
+
+@st.fragment(run_every="1s")
+def _job_poller(job, key, label, name, done_message, columns, show_flag):
+    # reruns every second while it is rendered, the page reload at the end of the job removes it
+    state = job.snapshot()
+    if state["status"] in ("queued", "running"):
+        done = state["completed"] + state["failed"]
+        st.progress(done / state["total"] if state["total"] else 0.0,
+                    text=f"{label}... {done}/{state['total']} ({state['elapsed']:.0f}s)")
+        st.caption(" · ".join(f"{status}: {n}" for status, n in sorted(state["counts"].items())))
+        if st.button(f"Cancel {name}", key=f"cancel_{key}"):
+            job.cancel()
+        if state["recent"]:
+            recent = pd.DataFrame(state["recent"][::-1])
+            st.dataframe(recent[[c for c in columns if c in recent.columns]], hide_index=True)
+        return
+    # finished: report once and reload the page with the new results
+    st.session_state.pop(key, None)
+    jobs.release(job.id)
+    if state["status"] == "done":
+        st.session_state[f"{key}_message"] = ("success", done_message)
+    elif state["status"] == "cancelled":
+        st.session_state[f"{key}_message"] = ("warning", f"{name.capitalize()} cancelled after {state['completed']} of {state['total']} emails.")
+    else:
+        st.session_state[f"{key}_message"] = ("error", f"An error occurred during {name}: {state['error'].splitlines()[0]}")
+    if show_flag:
+        st.session_state[show_flag] = True
+    st.rerun(scope="app")
+
+def job_message(key):
+    if f"{key}_message" in st.session_state:
+        level, message = st.session_state.pop(f"{key}_message")
+        getattr(st, level)(message)
+
 # Sidebar: Navigation & Prompt Settings
 with st.sidebar:
     st.header("Navigation")
@@ -61,7 +191,7 @@ with st.sidebar:
     # Using an expander for "expandable contractable side"
     # although the sidebar itself is collapsible, having an expander inside is also good organization.
     with st.expander("Edit Prompts", expanded=False):
-        prompts_data = load_data(PROMPTS_PATH)
+        prompts_data = load_data("prompts", store.prompts)
         if prompts_data:
             with st.form("prompts_form"):
                 updated_prompts = {}
@@ -71,32 +201,75 @@ with st.sidebar:
                     updated_prompts[key] = st.text_area(label, value, height=150)
                 
                 if st.form_submit_button("Save Prompts"):
-                    if save_data(PROMPTS_PATH, updated_prompts):
+                    if save_data(store.save_prompts, updated_prompts):
                         st.success("Prompts updated successfully!")
                         st.rerun()
         else:
             st.error("Could not load prompts.")
 
+    st.divider()
+    st.header("⚡ Response Cache")
+    # opt-in, repeated questions about the same email are answered without calling the model
+    use_response_cache = st.toggle("Cache agent responses", key="use_response_cache")
+    cache_stats = response_cache.stats()
+    st.caption(f"Hits: {cache_stats['hits']} · Misses: {cache_stats['misses']} · "
+               f"Hit rate: {cache_stats['hit_rate']:.0%} · Entries: {cache_stats['size']}")
+
+    st.divider()
+    st.header("📈 Diagnostics")
+    with st.expander("Pipeline Metrics", expanded=False):
+        model_calls = scheduler.stats()
+        st.caption(f"Model calls running: {model_calls['active']} · queued: {model_calls['queued']['interactive']} chat, "
+                   f"{model_calls['queued']['batch']} batch" + (" · circuit open, calls paused" if model_calls["circuit_open"] else ""))
+        snapshot = metrics.snapshot()
+        if snapshot["stages"]:
+            st.dataframe(
+                pd.DataFrame([
+                    {"stage": name, "runs": stage["count"], "mean ms": round(stage["mean"] * 1000, 1),
+                     "p95 ms": round(stage["p95"] * 1000, 1), "max ms": round(stage["max"] * 1000, 1),
+                     "failures": stage["failures"]}
+                    for name, stage in sorted(snapshot["stages"].items())
+                ]),
+                hide_index=True
+            )
+            for name, value in sorted(snapshot["counters"].items()):
+                st.caption(f"{name.replace('_', ' ')}: {value}")
+            if st.button("Export Prometheus metrics"):
+                st.success(f"Written to {metrics.write_prometheus()}")
+        else:
+            st.info("No metrics recorded yet.")
+
 if st.session_state.page == "Home":
     st.title("📧 Email Productivity Agent")
 
     # Section 1: Load Raw Emails
     st.header("📥 Inbox")
+    if 'show_inbox' not in st.session_state:
+        st.session_state.show_inbox = False
     if st.button("Load Emails"):
-        data = load_data(INBOX_PATH)
-        if data:
-            # Handle structure: {"emails": [...]} or [...]
-            emails = data.get("emails", []) if isinstance(data, dict) else data
-            
-            if emails:
-                st.success(f"Found {len(emails)} emails.")
-                for i, email in enumerate(emails):
-                    subject = email.get('subject', 'No Subject')
-                    sender = email.get('sender', 'Unknown Sender')
-                    with st.expander(f"{i+1}. {subject} | {sender}"):
-                        st.write(f"**From:** {sender}")
-                        st.write(f"**To:** {', '.join(email.get('recipients', []))}")
-                        st.write(f"**Date:** {email.get('timestamp', 'N/A')}")
+        st.session_state.show_inbox = True
+
+    if st.session_state.show_inbox:
+        total = load_data("inbox", store.count, "inbox") or 0
+        if total:
+            st.success(f"Found {total} emails.")
+            # only the current page is queried and rendered
+            limit, offset = paginate("inbox", total)
+            # a page is one indexed query, it is not cached: its bodies would stay in memory for every page visited
+            try:
+                emails = store.emails("inbox", limit=limit, offset=offset)
+            except Exception as e:
+                st.error(f"Error loading data: {e}")
+                emails = []
+            for i, email in enumerate(emails, start=offset):
+                subject = email.get('subject', 'No Subject')
+                sender = email.get('sender', 'Unknown Sender')
+                with st.expander(f"{i+1}. {subject} | {sender}"):
+                    st.write(f"**From:** {sender}")
+                    st.write(f"**To:** {', '.join(email.get('recipients', []))}")
+                    st.write(f"**Date:** {email.get('timestamp', 'N/A')}")
+                    # body and raw JSON are only sent to the browser on demand
+                    if st.toggle("Show body and raw JSON", key=f"details_{i}"):
                         st.text_area("Body", email.get('body', ''), height=150, key=f"body_{i}")
                         st.json(email)
         else:
@@ -110,23 +283,35 @@ if st.session_state.page == "Home":
         st.session_state.show_processed = False
 
     if st.button("Re / Categorize Processed Emails"):
-        with st.spinner("Categorizing emails... This may take a while."):
-            try:
-                categorizer()
-                st.success("Emails categorized successfully!")
-                st.session_state.show_processed = True
-            except Exception as e:
-                st.error(f"An error occurred during categorization: {e}")
+        # runs in the background, the page stays usable while emails are categorized
+        st.session_state.categorize_job = start_categorization()
+
+    job_progress("categorize_job", "Categorizing emails", "categorization", "Emails categorized successfully!",
+                 ["id", "subject", "category", "priority", "summary"], show_flag="show_processed")
+    job_message("categorize_job")
 
     if st.session_state.show_processed:
-        processed_data = load_data(PROCESSED_PATH)
+        # Filtering happens on the shared email table, only the rows of the page are copied
+        table = email_table()
+        filter_col1, filter_col2 = st.columns(2)
+        with filter_col1:
+            category_filter = st.selectbox("Category", ["All"] + (table.values("category") if table is not None else []))
+        with filter_col2:
+            priority_filter = st.selectbox("Priority", ["All"] + (table.values("priority") if table is not None else []))
+        filters = {}
+        if category_filter != "All":
+            filters["category"] = category_filter
+        if priority_filter != "All":
+            filters["priority"] = priority_filter
+
+        positions = table.select(**filters) if table is not None else []
+        total = len(positions)
         
-        if processed_data:
-            # Ensure it's a list
-            emails_list = processed_data.get("emails", []) if isinstance(processed_data, dict) else processed_data
-            
-            if isinstance(emails_list, list) and len(emails_list) > 0:
-                df = pd.DataFrame(emails_list)
+        if total:
+            limit, offset = paginate("processed", total)
+            page_positions = positions[offset:offset + limit]
+            if len(page_positions) > 0:
+                df = table.frame.iloc[page_positions]
                 
                 # Select columns to display in the table (avoid cluttering with full body)
                 display_cols = ['id', 'category', 'priority', 'subject', 'sender', 'timestamp']
@@ -149,7 +334,7 @@ if st.session_state.page == "Home":
                 selected_rows = selection.get("selection", {}).get("rows", [])
                 if selected_rows:
                     selected_idx = selected_rows[0]
-                    selected_email = emails_list[selected_idx]
+                    selected_email = table.email(page_positions[selected_idx])
                     
                     st.divider()
                     st.subheader(f"Details: {selected_email.get('subject', 'No Subject')}")
@@ -169,67 +354,72 @@ if st.session_state.page == "Home":
                     st.write("**Action Items:**")
                     st.write(selected_email.get('action_items', 'None'))
                     
-                    with st.expander("Full Email Body"):
+                    if st.toggle("Full Email Body"):
                         st.text(selected_email.get('body', ''))
                     
-                    with st.expander("Raw JSON Data"):
+                    if st.toggle("Raw JSON Data"):
                         st.json(selected_email)
         else:
             st.info("No processed emails found.")
 
         # Section 3: Action Items List
-        if isinstance(emails_list, list) and len(emails_list) > 0:
+        # tasks are parsed once when the emails are stored, every view is a lookup in the deadline index
+        if total:
             st.divider()
             st.header("📝 Action Items List")
-            
-            # Filter emails that have action items
-            action_emails = [e for e in emails_list if e.get('action_items')]
-            
-            if action_emails:
-                for email in action_emails:
-                    sender_name = email.get('sender_name', 'Unknown Name')
-                    sender_email = email.get('sender', 'Unknown Email')
-                    action_items = email.get('action_items')
-                    
-                    with st.container():
-                        st.markdown(f"**From:** {sender_name} (`{sender_email}`)")
-                        st.info(action_items)
-            else:
-                st.info("No action items found.")
+            today = date.today()
+            overdue_tab, today_tab, upcoming_tab, sender_tab, all_tab = st.tabs(
+                ["⏰ Overdue", "📅 Due Today", f"🗓️ Next {UPCOMING_DAYS} Days", "👤 By Sender", "📋 All"])
+            with overdue_tab:
+                task_list(load_data("processed", overdue, store, today), "Nothing overdue.")
+            with today_tab:
+                task_list(load_data("processed", due_today, store, today), "Nothing due today.")
+            with upcoming_tab:
+                task_list(load_data("processed", upcoming, store, UPCOMING_DAYS, today), "Nothing due in the coming days.")
+            with sender_tab:
+                senders = load_data("processed", store.task_senders) or []
+                if senders:
+                    sender = st.selectbox("Sender", senders, key="task_sender",
+                                          format_func=lambda s: f"{s['sender_name'] or s['sender']} ({s['tasks']})")
+                    task_list(load_data("processed", by_sender, store, sender["sender"]), "No action items found.")
+                else:
+                    st.info("No action items found.")
+            with all_tab:
+                task_list(load_data("processed", store.tasks), "No action items found.")
 
 elif st.session_state.page == "Email Agent":
     st.title("🤖 Email Agent")
     
     # Load Data
-    processed_data = load_data(PROCESSED_PATH)
-    prompts_data = load_data(PROMPTS_PATH)
-    
-    emails_list = []
-    if processed_data:
-        emails_list = processed_data.get("emails", []) if isinstance(processed_data, dict) else processed_data
+    prompts_data = load_data("prompts", store.prompts)
 
     # Sidebar: Email Selection
     with st.sidebar:
+        if "history" in st.session_state:
+            totals = st.session_state.history.total_usage
+            st.caption(f"Session tokens: {totals['prompt_tokens']} prompt · {totals['completion_tokens']} completion "
+                       f"over {totals['turns']} turns")
         st.divider()
         st.subheader("Select Context")
         
-        email_options = ["None (General Inbox)"] + [f"{i+1}. {e.get('subject')} | {e.get('sender')}" for i, e in enumerate(emails_list)]
-        selected_option = st.selectbox("Select an email to discuss:", email_options)
-        
-        selected_email = None
-        if selected_option != "None (General Inbox)":
-            index = int(selected_option.split('.')[0]) - 1
-            selected_email = emails_list[index]
+        selected_email = email_selector("Select an email to discuss:", "agent_email", allow_none="None (General Inbox)")
+        if selected_email:
             st.info(f"**Focus:** {selected_email.get('subject')}")
 
     # Chat Interface
     if "messages" not in st.session_state:
         st.session_state.messages = []
+    # keeps the prompt bounded in long chats, older turns are summarized
+    if "history" not in st.session_state:
+        st.session_state.history = HistoryManager()
 
     # Display chat messages
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
+            if message.get("usage"):
+                st.caption(f"Prompt tokens: {message['usage']['prompt_tokens']} · "
+                           f"Completion tokens: {message['usage']['completion_tokens']}")
 
     # Chat Input
     if prompt := st.chat_input("Ask the agent (e.g., 'Summarize this', 'Draft a reply')..."):
@@ -240,33 +430,32 @@ elif st.session_state.page == "Email Agent":
 
         # 2. Get Agent Response
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                try:
-                    response = get_agent_response(
-                        user_query=prompt,
-                        chat_history=st.session_state.messages[:-1], # Pass history excluding current prompt
-                        selected_email=selected_email,
-                        inbox=emails_list,
-                        prompts=prompts_data if prompts_data else {}
-                    )
-                    st.markdown(response)
-                    st.session_state.messages.append({"role": "assistant", "content": response})
-                except Exception as e:
-                    st.error(f"Error: {e}")
+            try:
+                usage = {}
+                # tokens are rendered as they arrive, write_stream returns the full answer
+                response = st.write_stream(stream_agent_response(
+                    user_query=prompt,
+                    chat_history=st.session_state.messages[:-1], # Pass history excluding current prompt
+                    selected_email=selected_email,
+                    prompts=prompts_data if prompts_data else {},
+                    use_cache=use_response_cache,
+                    history=st.session_state.history,
+                    usage=usage
+                ))
+                st.session_state.messages.append({"role": "assistant", "content": response, "usage": usage})
+                st.caption(f"Prompt tokens: {usage.get('prompt_tokens', 0)} · "
+                           f"Completion tokens: {usage.get('completion_tokens', 0)}")
+            except Exception as e:
+                st.error(f"Error: {e}")
 
 elif st.session_state.page == "Draft Agent":
     st.title("📝 Draft Generation Agent")
     
     # Load Data
-    processed_data = load_data(PROCESSED_PATH)
-    prompts_data = load_data(PROMPTS_PATH)
-    drafts_data = load_data(DRAFTS_PATH) or []
-    
-    emails_list = []
-    if processed_data:
-        emails_list = processed_data.get("emails", []) if isinstance(processed_data, dict) else processed_data
+    prompts_data = load_data("prompts", store.prompts)
+    drafts_data = load_data("drafts", store.drafts) or []
 
-    tab1, tab2 = st.tabs(["✨ Create Draft", "📂 Saved Drafts"])
+    tab1, tab2, tab3 = st.tabs(["✨ Create Draft", "📂 Saved Drafts", "📬 Bulk Drafts"])
     
     with tab1:
         st.subheader("Generate New Draft")
@@ -278,11 +467,8 @@ elif st.session_state.page == "Draft Agent":
             
             selected_email_context = None
             if draft_type == "Reply to Email":
-                email_options = [f"{i+1}. {e.get('subject')} | {e.get('sender')}" for i, e in enumerate(emails_list)]
-                selected_option = st.selectbox("Select Email to Reply to:", email_options)
-                if selected_option:
-                    index = int(selected_option.split('.')[0]) - 1
-                    selected_email_context = emails_list[index]
+                selected_email_context = email_selector("Select Email to Reply to:", "draft_email")
+                if selected_email_context:
                     st.caption(f"Replying to: {selected_email_context.get('subject')}")
         
         with col2:
@@ -292,7 +478,7 @@ elif st.session_state.page == "Draft Agent":
                 if not instructions:
                     st.warning("Please provide instructions.")
                 else:
-                    with st.spinner("Drafting..."):
+                    with st.container(border=True):
                         # Construct prompt for the agent
                         prompt_text = f"Draft a {draft_type}."
                         if draft_type == "Reply to Email":
@@ -301,25 +487,15 @@ elif st.session_state.page == "Draft Agent":
                         prompt_text += "\n\nIMPORTANT: Return the draft in the following format:\nSubject: [Subject Line]\n\n[Body Text]"
                         
                         try:
-                            response = get_agent_response(
+                            response = st.write_stream(stream_agent_response(
                                 user_query=prompt_text,
                                 chat_history=[],
                                 selected_email=selected_email_context,
-                                inbox=emails_list,
-                                prompts=prompts_data if prompts_data else {}
-                            )
-                            
-                            # Simple parsing (robustness can be improved)
-                            subject = "Draft Subject"
-                            body = response
+                                prompts=prompts_data if prompts_data else {},
+                                use_cache=use_response_cache
+                            ))
                             
-                            if "Subject:" in response:
-                                parts = response.split("\n", 1)
-                                if len(parts) > 0:
-                                    subject_line = parts[0]
-                                    if subject_line.startswith("Subject:"):
-                                        subject = subject_line.replace("Subject:", "").strip()
-                                        body = parts[1].strip() if len(parts) > 1 else ""
+                            subject, body = parse_draft(response)
                             
                             st.session_state.generated_subject = subject
                             st.session_state.generated_body = body
@@ -350,8 +526,7 @@ elif st.session_state.page == "Draft Agent":
                     "body": draft_body,
                     "status": "saved"
                 }
-                drafts_data.append(new_draft)
-                if save_data(DRAFTS_PATH, drafts_data):
+                if save_data(store.save_draft, new_draft):
                     st.success("Draft saved successfully!")
                     # Clear state
                     st.session_state.generated_subject = ""
@@ -366,8 +541,28 @@ elif st.session_state.page == "Draft Agent":
                     st.write(f"**Type:** {draft.get('type')}")
                     st.text_area("Body", draft.get('body'), height=200, key=f"view_{draft['id']}")
                     if st.button("Delete", key=f"del_{draft['id']}"):
-                        drafts_data.remove(draft)
-                        save_data(DRAFTS_PATH, drafts_data)
+                        save_data(store.delete_draft, draft['id'])
                         st.rerun()
         else:
-            st.info("No saved drafts.")
\ No newline at end of file
+            st.info("No saved drafts.")
+
+    with tab3:
+        st.subheader("Draft Replies in Bulk")
+        st.caption("Drafts a reply to every matching email without a saved draft. Spam and no-reply senders are skipped.")
+        categories = load_data("processed", store.distinct, "processed", "category") or []
+        priorities = load_data("processed", store.distinct, "processed", "priority") or []
+        bulk_col1, bulk_col2 = st.columns(2)
+        with bulk_col1:
+            bulk_categories = st.multiselect("Categories", categories, default=[c for c in DEFAULT_CATEGORIES if c in categories])
+        with bulk_col2:
+            bulk_priorities = st.multiselect("Priorities (all if empty)", priorities)
+        bulk_instructions = st.text_input("Instructions for every draft (optional)", placeholder="e.g., 'Confirm and propose a call next week'")
+        # counted in the shared email table, bodies are only read by the job once it is started
+        matching = len(select_positions(bulk_categories, bulk_priorities)) if bulk_categories else 0
+        st.write(f"**{matching}** emails will get a draft.")
+        if st.button("Generate Drafts", disabled=not matching):
+            st.session_state.drafts_job = start_drafts(categories=bulk_categories, priorities=bulk_priorities or None,
+                                                       instructions=bulk_instructions or None)
+        job_progress("drafts_job", "Drafting replies", "drafting", "Drafts generated! See the Saved Drafts tab.",
+                     ["id", "to", "subject", "body"])
+        job_message("drafts_job")
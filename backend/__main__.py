@@ -0,0 +1,151 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+#headless entry point for scheduled runs: python -m backend {ingest,categorize,drafts}
+#each command imports what it needs, so --help and ingest never load LangChain or the Gemini client
+
+
+def _ingest(args, summary):
+    from backend.extractor import extractMailbox
+    from backend.store import get_store
+    summary["ingested"] = extractMailbox.ingest(args.input, args.chunk_size)
+    summary["inbox"] = get_store().count("inbox")
+
+
+def _categorize(args, summary):
+    if args.all_mailboxes:
+        return _categorize_mailboxes(args, summary)
+    from backend.categorizer import categorizer
+    from backend.jobs import Job
+    from backend.store import get_store
+    inbox = None
+    if args.input:
+        from backend.extractor import extractMailbox
+        inbox = extractMailbox.extract(args.input)
+    # the job only collects the per-email outcome for the summary
+    job = Job("categorize")
+    try:
+        categorizer(max_workers=args.workers, requests_per_minute=args.rpm, use_cache=not args.no_cache,
+                    batch_size=args.batch_size, resume=not args.no_resume, inbox=inbox, chunk_size=args.chunk_size,
+                    job=job)
+    finally:
+        state = job.snapshot()
+        summary["emails"] = state["total"]
+        summary["results"] = state["counts"]
+    if args.output:
+        get_store().export_json("processed", args.output)
+        summary["output"] = os.path.abspath(args.output)
+    summary["processed"] = get_store().count("processed")
+
+
+def _categorize_mailboxes(args, summary):
+    from backend.mailboxes import categorize_mailboxes
+    if args.input or args.output:
+        raise ValueError("--input and --output work on one mailbox, not with --all-mailboxes")
+    summary["mailboxes"] = categorize_mailboxes(
+        processes=args.processes, max_concurrency=args.max_concurrency, requests_per_minute=args.rpm,
+        max_workers=args.workers, use_cache=not args.no_cache, batch_size=args.batch_size, resume=not args.no_resume)
+    failed = [name for name, result in summary["mailboxes"].items() if result["status"] != "ok"]
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(summary['mailboxes'])} mailboxes failed: {', '.join(failed)}")
+
+
+def _drafts(args, summary):
+    from backend.drafter import DEFAULT_CATEGORIES, bulk_drafts
+    from backend.jobs import Job
+    from backend.store import get_store
+    job = Job("drafts")
+    try:
+        drafts = bulk_drafts(categories=args.category or DEFAULT_CATEGORIES, priorities=args.priority or None,
+                             max_workers=args.workers, requests_per_minute=args.rpm, instructions=args.instructions,
+                             job=job)
+        summary["drafted"] = len(drafts)
+    finally:
+        state = job.snapshot()
+        summary["emails"] = state["total"]
+        summary["results"] = state["counts"]
+    if args.output:
+        get_store().export_json("drafts", args.output)
+        summary["output"] = os.path.abspath(args.output)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m backend",
+                                     description="Run the email pipeline without the UI. Prints a JSON summary of the run.")
+    parser.add_argument("--root", help="directory holding sources/ (default: current directory)")
+    parser.add_argument("--mailbox", default="default", help="mailbox to work in, sources/<name>/ (default: sources/)")
+    parser.add_argument("--summary", help="also write the JSON summary to this file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser("ingest", help="add an mbox file or Maildir directory to the inbox")
+    ingest.add_argument("input", help="mbox file or Maildir directory")
+    ingest.add_argument("--chunk-size", type=int, default=500, help="messages written per transaction")
+    ingest.set_defaults(handler=_ingest)
+
+    categorize = commands.add_parser("categorize", help="categorize the inbox into the processed inbox")
+    categorize.add_argument("--input", help="stream this mbox file or Maildir directory instead of the stored inbox")
+    categorize.add_argument("--output", help="export the processed emails to this JSON file")
+    categorize.add_argument("--workers", type=int, default=4, help="model calls at the same time")
+    categorize.add_argument("--rpm", type=float, help="requests per minute for this run (shared by all processes)")
+    categorize.add_argument("--batch-size", type=int, default=1, help="emails per model request")
+    categorize.add_argument("--chunk-size", type=int, default=500, help="emails read at a time with --input")
+    categorize.add_argument("--no-cache", action="store_true", help="ignore cached results")
+    categorize.add_argument("--no-resume", action="store_true", help="ignore the checkpoint of an interrupted run")
+    categorize.add_argument("--all-mailboxes", action="store_true", help="categorize every mailbox, in parallel processes")
+    categorize.add_argument("--processes", type=int, help="worker processes with --all-mailboxes (default: CPU count)")
+    categorize.add_argument("--max-concurrency", type=int,
+                            help="model calls in flight across all processes (default: EMAIL_AGENT_MAX_CONCURRENCY or 8)")
+    categorize.set_defaults(handler=_categorize)
+
+    drafts = commands.add_parser("drafts", help="draft replies for processed emails without a draft")
+    drafts.add_argument("--category", action="append", help="category to draft for, repeatable (default: To-Do, Meeting Request)")
+    drafts.add_argument("--priority", action="append", help="priority to draft for, repeatable (default: any)")
+    drafts.add_argument("--instructions", help="extra instructions for every draft")
+    drafts.add_argument("--output", help="export all drafts to this JSON file")
+    drafts.add_argument("--workers", type=int, default=4, help="model calls at the same time")
+    drafts.add_argument("--rpm", type=float, help="requests per minute for this run")
+    drafts.set_defaults(handler=_drafts)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.root:
+        os.chdir(args.root)
+    summary = {"command": args.command, "mailbox": args.mailbox, "status": "ok"}
+    started = time.perf_counter()
+    try:
+        from backend.mailboxes import DEFAULT, create_mailbox, list_mailboxes, set_mailbox
+        if args.mailbox != DEFAULT and args.mailbox not in list_mailboxes():
+            # ingesting into a new mailbox creates it, the other commands need an existing one
+            if args.command != "ingest":
+                raise ValueError(f"No mailbox named {args.mailbox!r}, ingest a mailbox into it first")
+            create_mailbox(args.mailbox)
+        set_mailbox(args.mailbox)
+        args.handler(args, summary)
+    except Exception as e:
+        summary["status"] = "failed"
+        summary["error"] = f"{type(e).__name__}: {e}"
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+    from backend.mailboxes import COUNTERS
+    from backend.metrics import metrics
+    counters = metrics.snapshot()["counters"]
+    summary["model"] = {name: counters.get(name, 0) for name in COUNTERS}
+    # worker processes count their own calls
+    for result in summary.get("mailboxes", {}).values():
+        for name, value in result.get("model", {}).items():
+            summary["model"][name] += value
+
+    text = json.dumps(summary, indent=2, default=str)
+    print(text)
+    if args.summary:
+        with open(args.summary, "w") as f:
+            f.write(text + "\n")
+    return 0 if summary["status"] == "ok" else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
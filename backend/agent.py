@@ -1,63 +1,74 @@
 from dotenv import load_dotenv
 load_dotenv()
 
-from langchain.tools import tool
 from typing import TypedDict, Annotated, List, Dict, Any
 import operator
-from langchain_google_genai import ChatGoogleGenerativeAI
+from datetime import date
+from functools import lru_cache
 from langchain_core.messages import SystemMessage, HumanMessage, BaseMessage, AIMessage
-from langgraph.graph import StateGraph, END
+from backend.store import get_store
+from backend.responsecache import response_cache, make_key
+from backend.history import HistoryManager, estimate_tokens
+from backend.llm import chat_model
+from backend.metrics import metrics
+from backend.scheduler import scheduler, INTERACTIVE
 
 
 class AgentState(TypedDict):
     messages : Annotated[List[BaseMessage],operator.add]
     selected_email : Dict[str,Any] | None
-    inbox : List[Dict[str,Any]]
     prompts : Dict[str, str]
+    history_summary : str
 
-# @tool(description="If No Specific email is selected agent can look for the possible answers here")
-# def email_info() -> str:
-#     return "It's sunny."
+@metrics.timed("agent.extract_info")
 def extract_info():
-    import json
-    InboxFile = "sources/processed_inbox.json"
-    with open(InboxFile,"r") as f:
-        raw = json.load(f)
-    emails = []
-    for email in raw:
-        emails.append({
-        
-        # "id": email.id,
-        "message_id": email["message_id"],
-        "sender": email["sender"],
-        "sender_name": email["sender_name"],
-        "recipients": email["recipients"],
-        "subject": email["subject"],
-        # "body": email.body,
-        "timestamp": email["timestamp"],
-        "category": email["category"],
-        "priority": email["priority"],
-        "is_spam": email['is_spam'],
-        "action_items": email['action_items'],
-        "summary": email['summary'],
-        "has_attachment": email['has_attachment'],
-        "attachment_names": email['attachment_names']
-        
-        })
-    return emails
+    # every processed email without its body, read from the shared EmailTable
+    from backend.emailtable import get_email_table
+    return get_email_table().records()
 
 
-def call_model(state: AgentState):
-    llm = ChatGoogleGenerativeAI(
+@lru_cache(maxsize=None)
+def get_llm():
+    # one client per process, reused by every chat turn
+    return chat_model(
         model="gemini-2.5-flash",
         temperature=0.3,
-        max_retries=2
+        # retries go through the shared scheduler, chat turns go ahead of batch work there
+        max_retries=0
     )
+
+
+@lru_cache(maxsize=None)
+def get_tool_llm():
+    # the model can look emails up with the tools of backend.querytools
+    from backend.querytools import TOOLS
+    return get_llm().bind_tools(TOOLS)
+
+
+@lru_cache(maxsize=None)
+def get_graph():
+    # the graph never changes between turns, compile it once
+    # LangGraph is imported here, on the first turn, not when the module is imported
+    from langgraph.graph import StateGraph, END
+    from langgraph.prebuilt import ToolNode, tools_condition
+    from backend.querytools import TOOLS
+    workflow = StateGraph(AgentState)
+    workflow.add_node("agent",call_model)
+    workflow.add_node("tools",ToolNode(TOOLS))
+    workflow.set_entry_point("agent")
+    # the agent either answers or calls tools, whose results go back to it
+    workflow.add_conditional_edges("agent",tools_condition,{"tools":"tools",END:END})
+    workflow.add_edge("tools","agent")
+    return workflow.compile()
+
+
+@metrics.timed("agent.call_model")
+def call_model(state: AgentState):
+    llm = get_tool_llm()
     
     messages = state['messages']
     selected_email = state.get("selected_email")
     prompts = state.get("prompts", {})
-    inbox = state.get('inbox',[])
     
     system_text = """You are an intelligent Email Productivity Agent designed to help the user manage their inbox.
 You can summarize emails, extract action items, draft replies, and answer general questions about the inbox.
@@ -74,11 +85,18 @@ You can summarize emails, extract action items, draft replies, and answer genera
         system_text += f"--------------------------------\n"
         system_text += "The user's query likely relates to this specific email. Use this context to answer."
     else:
-        emails_info = extract_info()
+        # emails are fetched with the tools, only the matching rows enter the conversation
+        from backend.querytools import get_query_index
+        index = get_query_index()
         system_text += f"\n\n--- INBOX CONTEXT ---\n"
-        system_text += f"No specific email is selected. You have access to {len(inbox)} emails in the inbox.\n"
-        system_text += f"Feel free to use the {emails_info}, if the user asks about specific email, ask them to select one from the side bar."
-        # system_text += "If the user asks about specific emails, ask them to select one from the sidebar or provide more details."
+        system_text += f"No specific email is selected. You have access to {len(index)} emails in the inbox.\n"
+        system_text += f"Today is {date.today().isoformat()}.\n"
+        system_text += f"Categories: {', '.join(index.values('category'))}. Priorities: {', '.join(index.values('priority'))}.\n"
+        system_text += ("Use find_emails to filter by sender, category, priority, date or deadline, search_emails for topics "
+                        "and get_email for the full text of one email. Do not guess emails you have not looked up.")
+
+    if state.get("history_summary"):
+        system_text += f"\n\n--- EARLIER CONVERSATION (SUMMARY) ---\n{state['history_summary']}\n"
 
     system_text += "\n\n--- USER PREFERENCES & PROMPTS ---\n"
     if 'auto_reply_prompt' in prompts:
@@ -92,12 +110,47 @@ You can summarize emails, extract action items, draft replies, and answer genera
 
     conversation = [SystemMessage(content=system_text)] + messages
     
-    response = llm.invoke(conversation)
+    response = scheduler.call(lambda: llm.invoke(conversation), INTERACTIVE)
     return {"messages": [response]}
 
-def get_agent_response(user_query: str, chat_history: List[Dict], selected_email: Dict, inbox: List, prompts: Dict):
+def summarize_history(summary: str, messages: List[Dict]):
+    # folds the messages leaving the verbatim window into the running summary, returns (summary, usage)
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    prompt = [HumanMessage(content=(
+        "Update the summary of a conversation between a user and their email assistant with the new messages. "
+        "Keep names, email subjects, decisions and open questions. Answer with the summary only.\n\n"
+        f"Current summary:\n{summary or '(empty)'}\n\nNew messages:\n{transcript}"))]
+    response = scheduler.call(lambda: get_llm().invoke(prompt), INTERACTIVE)
+    return response.text, token_usage(response, prompt)
+
+def token_usage(message, prompt_messages):
+    # prefers the counts reported by the model, estimates them otherwise
+    meta = getattr(message, "usage_metadata", None) or {}
+    if meta:
+        return {"prompt_tokens": meta.get("input_tokens", 0), "completion_tokens": meta.get("output_tokens", 0), "estimated": False}
+    return {
+        "prompt_tokens": sum(estimate_tokens(str(m.content)) for m in prompt_messages),
+        "completion_tokens": estimate_tokens(message.text if message is not None else ""),
+        "estimated": True,
+    }
+
+def add_usage(total: Dict, call_usage: Dict | None):
+    # adds the usage of one model call to the usage of the turn
+    if call_usage:
+        total["prompt_tokens"] += call_usage["prompt_tokens"]
+        total["completion_tokens"] += call_usage["completion_tokens"]
+        total["estimated"] = total["estimated"] or call_usage["estimated"]
+    return total
+
+def report_usage(turn_usage: Dict, usage: Dict | None, history: HistoryManager | None):
+    if usage is not None:
+        usage.update(turn_usage)
+    if history is not None:
+        history.record(turn_usage)
+
+def build_inputs(user_query: str, chat_history: List[Dict], selected_email: Dict, prompts: Dict,
+                 history_summary: str = ""):
     """
-    Entry point for the Streamlit app to call the agent.'
     Making the info grabbed be streamlit agent ready.
     """
     lc_messages = []
@@ -109,19 +162,85 @@ def get_agent_response(user_query: str, chat_history: List[Dict], selected_email
     
     lc_messages.append(HumanMessage(content=user_query))
     
-    workflow = StateGraph(AgentState)
-    workflow.add_node("agent",call_model)
-    workflow.set_entry_point("agent")
-    workflow.add_edge("agent",END)
-    app = workflow.compile()
-    
-    inputs = {
+    return {
         "messages": lc_messages,
         "selected_email": selected_email,
-        "inbox": inbox,
-        "prompts": prompts
+        "prompts": prompts,
+        "history_summary": history_summary
     }
-    
-    result = app.invoke(inputs)
 
-    return result['messages'][-1].content
\ No newline at end of file
+def cache_key(user_query: str, chat_history: List[Dict], selected_email: Dict, prompts: Dict):
+    # versions of different mailboxes are unrelated, the database path tells them apart
+    store = get_store()
+    data_version = None if selected_email else (store.path, store.version("processed"))
+    return make_key(user_query, chat_history, selected_email, prompts, data_version)
+
+def get_agent_response(user_query: str, chat_history: List[Dict], selected_email: Dict, prompts: Dict,
+                       use_cache: bool = False, history: HistoryManager | None = None, usage: Dict | None = None):
+    """
+    Entry point for the Streamlit app to call the agent.'
+    With `use_cache`, a repeated question about the same email is answered from the response cache.
+    With `history`, only the recent turns are sent verbatim and older ones as a rolling summary.
+    Prompt and completion token counts of the turn, summarizing the history included, are written to `usage`
+    and recorded on `history`.
+    """
+    key = cache_key(user_query, chat_history, selected_email, prompts) if use_cache else None
+    if key:
+        cached = response_cache.get(key)
+        if cached is not None:
+            report_usage({"prompt_tokens": 0, "completion_tokens": 0, "estimated": False, "cached": True}, usage, history)
+            return cached
+
+    # summarizing older messages is a model call of the turn too
+    turn_usage = {"prompt_tokens": 0, "completion_tokens": 0, "estimated": False}
+    summary = ""
+    if history is not None:
+        summary, chat_history, summary_usage = history.compact(chat_history, summarize_history)
+        add_usage(turn_usage, summary_usage)
+    inputs = build_inputs(user_query, chat_history, selected_email, prompts, summary)
+    result = get_graph().invoke(inputs)
+    answer = result['messages'][-1].content
+
+    # a turn with tool calls makes several model calls, all of them count
+    for message in result['messages'][len(inputs["messages"]):]:
+        if isinstance(message, AIMessage):
+            add_usage(turn_usage, token_usage(message, inputs["messages"]))
+    report_usage(turn_usage, usage, history)
+    if key:
+        response_cache.put(key, answer)
+    return answer
+
+def stream_agent_response(user_query: str, chat_history: List[Dict], selected_email: Dict, prompts: Dict,
+                          use_cache: bool = False, history: HistoryManager | None = None, usage: Dict | None = None):
+    """
+    Same as get_agent_response but yields the answer token by token as the model produces it.
+    """
+    key = cache_key(user_query, chat_history, selected_email, prompts) if use_cache else None
+    if key:
+        cached = response_cache.get(key)
+        if cached is not None:
+            report_usage({"prompt_tokens": 0, "completion_tokens": 0, "estimated": False, "cached": True}, usage, history)
+            yield cached
+            return
+
+    # summarizing older messages is a model call of the turn too
+    turn_usage = {"prompt_tokens": 0, "completion_tokens": 0, "estimated": False}
+    summary = ""
+    if history is not None:
+        summary, chat_history, summary_usage = history.compact(chat_history, summarize_history)
+        add_usage(turn_usage, summary_usage)
+    inputs = build_inputs(user_query, chat_history, selected_email, prompts, summary)
+    parts = []
+    final = None
+    for chunk, metadata in get_graph().stream(inputs, stream_mode="messages"):
+        if metadata.get("langgraph_node") == "agent" and isinstance(chunk, AIMessage):
+            # chunks add up, including their usage metadata
+            final = chunk if final is None else final + chunk
+            if chunk.text:
+                parts.append(chunk.text)
+                yield chunk.text
+
+    report_usage(add_usage(turn_usage, token_usage(final, inputs["messages"])), usage, history)
+    # only complete answers are cached, an interrupted stream never gets here
+    if key:
+        response_cache.put(key, "".join(parts))
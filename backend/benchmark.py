@@ -0,0 +1,261 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+#benchmarks of categorization, agent turns and store load/save against the fake chat model
+#usage: python -m backend.benchmark --sizes 1000,10000 --workers 8 --latency 0.05
+
+SENDERS = [
+    ("john.smith@company.com", "John Smith"),
+    ("lisa.martinez@company.com", "Lisa Martinez"),
+    ("mike.chen@company.com", "Mike Chen"),
+    ("sarah.jones@client.com", "Sarah Jones"),
+    ("noreply@github.com", "GitHub"),
+    ("weekly-digest@techcrunch.com", "TechCrunch Weekly Digest"),
+    ("promo@deals-online.biz", "Deals Online"),
+    ("hr@company.com", "HR Team"),
+]
+
+SUBJECTS = [
+    "Meeting Request: {topic} sync",
+    "Action needed: review {topic} by Friday",
+    "{topic} status update - week {n}",
+    "Weekly digest: {topic} news",
+    "You won a {topic} voucher!!!",
+    "Lunch on Thursday?",
+    "Re: {topic} budget approval",
+]
+
+TOPICS = ["Q4 roadmap", "analytics dashboard", "marketing campaign", "website redesign", "hiring plan", "security audit"]
+
+BODY = ("Hi,\n\n{opening}\n\n{detail}\n\nPlease let me know by {day} if you have any questions.\n\n"
+        "Best regards,\n{name}")
+
+OPENINGS = [
+    "I'd like to schedule a meeting to discuss the {topic}.",
+    "Here is the latest update on the {topic}.",
+    "Could you review the attached {topic} document?",
+    "This week's digest covers the {topic} and more.",
+]
+
+PROMPTS = {
+    "categorization_prompt": "Categorize the following email into one of these categories: Important, Newsletter, Spam, To-Do.",
+    "action_item_prompt": "Extract all actionable tasks from the email. Respond in JSON format: {\"tasks\": [], \"deadline\": null}",
+    "auto_reply_prompt": "Draft a professional and polite reply to this email.",
+}
+
+QUERIES = [
+    "What do I need to do for the {topic}?",
+    "Summarize the emails from {name}",
+    "Are there any meetings about the {topic}?",
+    "Which emails are high priority?",
+]
+
+
+def generate_inbox(n, seed: int = 0):
+    """
+    Returns `n` synthetic emails in the sources/inbox.json format.
+    """
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    emails = []
+    for i in range(n):
+        sender, name = rng.choice(SENDERS)
+        topic = rng.choice(TOPICS)
+        detail = " ".join(rng.choice(TOPICS) + " is on track." for _ in range(rng.randint(3, 30)))
+        attachments = [f"{topic.replace(' ', '_')}.pdf"] if rng.random() < 0.2 else []
+        emails.append({
+            "id": f"email_{i + 1:06d}",
+            "message_id": f"<msg_{i + 1:06d}@{sender.split('@')[1]}>",
+            "sender": sender,
+            "sender_name": name,
+            "recipients": ["user@company.com"],
+            "subject": rng.choice(SUBJECTS).format(topic=topic, n=rng.randint(1, 52)),
+            "body": BODY.format(opening=rng.choice(OPENINGS).format(topic=topic), detail=detail,
+                                day=rng.choice(["Monday", "Wednesday", "Friday"]), name=name),
+            "timestamp": (start + timedelta(minutes=37 * i)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "category": None,
+            "priority": None,
+            "is_spam": False,
+            "sentiment": None,
+            "action_items": None,
+            "summary": None,
+            "has_attachment": bool(attachments),
+            "attachment_names": attachments,
+        })
+    return emails
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    values = sorted(values)
+
+    def pick(q):
+        return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99)}
+
+
+class Stage:
+    # wall time and, when enabled, peak traced memory of a block
+
+    def __init__(self, trace_memory):
+        self.trace_memory = trace_memory
+
+    def __enter__(self):
+        if self.trace_memory:
+            tracemalloc.start()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.started
+        self.peak_mb = None
+        if self.trace_memory:
+            self.peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+        return False
+
+
+def run_size(n, args):
+    from backend import agent
+    from backend.categorizer import categorizer
+    from backend.extractor import extractInbox
+    from backend.fakellm import FakeChatModel
+    from backend.llm import set_chat_model_factory
+    from backend.store import get_store
+
+    model = FakeChatModel(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, seed=args.seed)
+    set_chat_model_factory(lambda **kwargs: model)
+    agent.get_llm.cache_clear()
+    agent.get_tool_llm.cache_clear()
+
+    result = {"emails": n}
+    inbox = generate_inbox(n, args.seed)
+    with open("sources/inbox.json", "w") as f:
+        json.dump({"emails": inbox}, f)
+    with open("sources/prompts.json", "w") as f:
+        json.dump(PROMPTS, f)
+    del inbox
+
+    with Stage(args.memory) as stage:
+        emails = extractInbox.extract()
+    result["load_import"] = {"seconds": stage.seconds, "peak_mb": stage.peak_mb}
+    with Stage(args.memory) as stage:
+        emails = extractInbox.extract()
+    result["load"] = {"seconds": stage.seconds, "peak_mb": stage.peak_mb}
+
+    with Stage(args.memory) as stage:
+        categorizer(max_workers=args.workers, use_cache=False, batch_size=args.batch_size)
+    calls = model.stats
+    result["categorize"] = {
+        "seconds": stage.seconds,
+        "peak_mb": stage.peak_mb,
+        "emails_per_sec": n / stage.seconds if stage.seconds else None,
+        "calls": len(calls),
+        "latency": percentiles([c["latency"] for c in calls]),
+        "prompt_chars_mean": statistics.mean(c["prompt_chars"] for c in calls) if calls else None,
+        "prompt_chars_max": max((c["prompt_chars"] for c in calls), default=None),
+    }
+
+    store = get_store()
+    processed = store.emails("processed")
+    with Stage(args.memory) as stage:
+        store.replace_emails("processed", processed)
+    result["save_upsert"] = {"seconds": stage.seconds, "peak_mb": stage.peak_mb}
+    with Stage(args.memory) as stage:
+        store.export_json("processed")
+    result["save_export"] = {"seconds": stage.seconds, "peak_mb": stage.peak_mb}
+
+    rng = random.Random(args.seed)
+    model.reset_stats()
+    turn_latencies, prompt_tokens = [], []
+    with Stage(args.memory) as stage:
+        for _ in range(args.agent_turns):
+            query = rng.choice(QUERIES).format(topic=rng.choice(TOPICS), name=rng.choice(SENDERS)[1])
+            selected = rng.choice(processed) if rng.random() < 0.5 else None
+            usage = {}
+            started = time.perf_counter()
+            agent.get_agent_response(query, [], selected, PROMPTS, usage=usage)
+            turn_latencies.append(time.perf_counter() - started)
+            prompt_tokens.append(usage.get("prompt_tokens", 0))
+    result["agent"] = {
+        "seconds": stage.seconds,
+        "peak_mb": stage.peak_mb,
+        "turns": args.agent_turns,
+        "latency": percentiles(turn_latencies),
+        "prompt_tokens_mean": statistics.mean(prompt_tokens) if prompt_tokens else None,
+        "prompt_tokens_max": max(prompt_tokens, default=None),
+    }
+    del emails, processed
+    set_chat_model_factory(None)
+    agent.get_llm.cache_clear()
+    agent.get_tool_llm.cache_clear()
+    return result
+
+
+def print_result(result):
+    def ms(value):
+        return "-" if value is None else f"{value * 1000:.1f}ms"
+
+    def mb(value):
+        return "-" if value is None else f"{value:.1f}MB"
+
+    cat, ag = result["categorize"], result["agent"]
+    print(f"== {result['emails']} emails ==")
+    print(f"load (import JSON)  {ms(result['load_import']['seconds'])}  peak {mb(result['load_import']['peak_mb'])}")
+    print(f"load (store)        {ms(result['load']['seconds'])}  peak {mb(result['load']['peak_mb'])}")
+    print(f"categorize          {cat['seconds']:.2f}s  {cat['emails_per_sec']:.1f} emails/s  {cat['calls']} calls  "
+          f"p50 {ms(cat['latency']['p50'])} p95 {ms(cat['latency']['p95'])} p99 {ms(cat['latency']['p99'])}  "
+          f"prompt {cat['prompt_chars_mean']:.0f} chars avg / {cat['prompt_chars_max']} max  peak {mb(cat['peak_mb'])}")
+    print(f"save (upsert)       {ms(result['save_upsert']['seconds'])}  peak {mb(result['save_upsert']['peak_mb'])}")
+    print(f"save (export JSON)  {ms(result['save_export']['seconds'])}  peak {mb(result['save_export']['peak_mb'])}")
+    print(f"agent turns         {ag['turns']} turns  p50 {ms(ag['latency']['p50'])} p95 {ms(ag['latency']['p95'])} "
+          f"p99 {ms(ag['latency']['p99'])}  prompt {ag['prompt_tokens_mean'] or 0:.0f} tokens avg / "
+          f"{ag['prompt_tokens_max']} max  peak {mb(ag['peak_mb'])}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the email pipeline against a fake chat model.")
+    parser.add_argument("--sizes", default="1000", help="comma separated inbox sizes, e.g. 1000,10000,100000")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.0, help="fake model latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--agent-turns", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="skip tracemalloc (it slows every stage down)")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = []
+    cwd = os.getcwd()
+    for n in [int(size) for size in args.sizes.split(",")]:
+        # every size runs against its own sources/ directory
+        workdir = tempfile.mkdtemp(prefix="email-bench-")
+        os.makedirs(os.path.join(workdir, "sources"))
+        os.chdir(workdir)
+        try:
+            result = run_size(n, args)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(workdir, ignore_errors=True)
+        print_result(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+    return results
+
+
+if __name__ == "__main__":
+    main()
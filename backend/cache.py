@@ -0,0 +1,73 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+from backend.mailboxes import mailbox_path
+
+#persistent cache of categorizer results, so unchanged emails are not sent to the model again
+
+# kept in the folder of the current mailbox
+CacheFile = "categorizer_cache.json"
+MAX_ENTRIES = 5000
+
+PROMPT_KEYS = ("categorization_prompt", "action_item_prompt", "auto_reply_prompt")
+
+
+def _digest(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part if part is not None else "").encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def email_hash(email):
+    return _digest(email.get("sender"), email.get("subject"), email.get("body"))
+
+
+def prompts_hash(prompts):
+    return _digest(*(prompts.get(key) for key in PROMPT_KEYS))
+
+
+class ResultCache:
+    def __init__(self, path: str | None = None, max_entries: int = MAX_ENTRIES):
+        path = path or mailbox_path(CacheFile)
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.dirty = False
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    self.entries = OrderedDict(json.load(f))
+            except (json.JSONDecodeError, OSError):
+                # a broken cache only costs us a recategorize
+                self.entries = OrderedDict()
+
+    @staticmethod
+    def key(email, prompts_digest):
+        return f"{email_hash(email)}:{prompts_digest}"
+
+    def get(self, key):
+        if key not in self.entries:
+            return None
+        # recency only matters once something else changes, so a hit does not force a write
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.path)
+        self.dirty = False
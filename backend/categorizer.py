@@ -1,27 +1,33 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pydantic import ValidationError
+from langchain_core.utils.json import parse_json_markdown
 from dotenv import load_dotenv
 from backend.extractor import extractInbox, extractPrompts, pushInbox
-from backend.structure import Email
+from backend.structure import CategorizedEmail, merge_result
+from backend.ratelimit import TokenBucket
+from backend.cache import ResultCache, prompts_hash
+from backend.checkpoint import Checkpoint
+from backend.history import estimate_tokens
+from backend.llm import chat_model
+from backend.metrics import metrics
+from backend.preclassifier import CONFIDENCE_THRESHOLD, TRAINING_FIELDS, get_preclassifier
+from backend.store import get_store
+from backend.scheduler import scheduler, BATCH
+from backend.threads import group_emails, representative
 
 load_dotenv()
 
-def categorizer():
-    inbox = extractInbox.extract()
-    User_prompts = extractPrompts.extract()
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-2.5-flash-lite",
-        temperature=0,
-        max_tokens=None,
-        timeout=None,
-        max_retries=2)
-    
-    categorized_emails = list()
-    
-    for email in inbox:
-        str_llm_json = llm.with_structured_output(Email, method="json_mode")
-        
-        prompt = f"""
-                You are an Email Categorization Agent. Read the following {email["body"]} and classify it into exactly one of these categories:
+# default number of emails sent to the model at the same time
+MAX_WORKERS = 4
+# prompt budget of one multi-email request
+BATCH_TOKEN_BUDGET = 8000
+# emails read at a time from a streamed inbox
+STREAM_CHUNK = 500
+
+
+def build_instructions(email_text, User_prompts):
+    return f"""
+                You are an Email Categorization Agent. Read the following {email_text} and classify it into exactly one of these categories:
 
     1. Important – time-sensitive or requires immediate attention.
     2. To-Do – contains a direct request, task, assignment, or instruction.
@@ -30,11 +36,11 @@ def categorizer():
     5. Newsletter – promotional, informational, or automated updates.
     6. Spam – irrelevant, overly promotional, or suspicious content.
     7. Personal – casual, friendly, non-work communication.
-    
+
     Special Note:- This->
-    {User_prompts["categorization_prompt"]}, 
+    {User_prompts["categorization_prompt"]},
     is given by the master user ,if there is are different commands for categorization use this instead for categorization.
-    If there are any special or unique instruction given in this prompt. Give this the main priority. 
+    If there are any special or unique instruction given in this prompt. Give this the main priority.
     If the email is catgorized as spam do not give it a priority
     Also,
     You are an Action Item Extraction Agent too. Extract all tasks the user must complete from the email.
@@ -47,13 +53,13 @@ Respond with a bullet list of tasks. If no task exists, return: "No action items
 
 
     Special Note:- This->
-    {User_prompts["action_item_prompt"]}, 
+    {User_prompts["action_item_prompt"]},
     is given by the master user ,if there is are different way of giving the action-item by the user use this instead for action-item extraction.
-    If there are any special or unique instruction given in this prompt. Give this the main priority. 
+    If there are any special or unique instruction given in this prompt. Give this the main priority.
     If the email is catgorized as spam do not generate action item for it.
-    
+
     And Lastly,
-    
+
     Draft a formal and concise reply to the following email.
     Based on {User_prompts["auto_reply_prompt"]}
     If the email is catgorized as spam do not generate auto reply for it.
@@ -66,10 +72,345 @@ Structure:
 5. Polite closing
 
 Do not invent facts. Do not include placeholders. Keep the tone professional.
+"""
+
+
+def build_prompt(email, User_prompts):
+    return build_instructions(email["body"], User_prompts) + """
+Respond with a JSON object holding only these fields:
+category, priority, is_spam, action_items, summary, reply_draft.
+Do not repeat the email itself.
+"""
+
+
+def format_email(email):
+    return (f"--- EMAIL {email['id']} ---\n"
+            f"From: {email.get('sender')} ({email.get('sender_name')})\n"
+            f"Subject: {email.get('subject')}\n"
+            f"Body:\n{email.get('body')}\n")
+
+
+def build_batch_prompt(emails, User_prompts):
+    prompt = build_instructions("emails listed at the end of this message one by one,", User_prompts)
+    prompt += """
+Respond with a JSON object of the form {"results": [...]} holding one entry per email, each with only these fields:
+email_id, category, priority, is_spam, action_items, summary, reply_draft.
+email_id must be the id written in the email header. Do not repeat the emails themselves.
 
-    
-    
 """
-        categorized_emails.append(str_llm_json.invoke(prompt))
-    
-    return pushInbox.pushIt(categorized_emails)
\ No newline at end of file
+    return prompt + "\n".join(format_email(email) for email in emails)
+
+
+def make_batches(emails, batch_size, max_batch_tokens, overhead):
+    """
+    Groups emails into batches of at most `batch_size` emails whose prompt stays
+    under `max_batch_tokens`. An email that does not fit alone still gets its own batch.
+    Returns the positions of the emails in each batch.
+    """
+    batches, current, used = [], [], overhead
+    for position, email in enumerate(emails):
+        cost = estimate_tokens(format_email(email))
+        full = len(current) >= batch_size or used + cost > max_batch_tokens
+        # results are matched back by id, so an id may only appear once per batch
+        clash = any(str(emails[other]["id"]) == str(email["id"]) for other in current)
+        if current and (full or clash):
+            batches.append(current)
+            current, used = [], overhead
+        current.append(position)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def parse_batch(response, emails):
+    """
+    Returns {email_id: CategorizedEmail} for the entries of a batch response that
+    validate. Missing or invalid entries are left out so they can be retried one by one.
+    """
+    ids = {str(email["id"]) for email in emails}
+    try:
+        raw = parse_json_markdown(response.text)
+    except (ValueError, TypeError):
+        return {}
+    entries = raw.get("results", []) if isinstance(raw, dict) else raw
+    parsed = {}
+    for entry in entries if isinstance(entries, list) else []:
+        if not isinstance(entry, dict) or str(entry.get("email_id")) not in ids:
+            continue
+        try:
+            parsed[str(entry["email_id"])] = CategorizedEmail.model_validate(entry)
+        except ValidationError:
+            continue
+    return parsed
+
+
+def categorizer(max_workers: int = MAX_WORKERS, requests_per_minute: float | None = None, use_cache: bool = True,
+                batch_size: int = 1, max_batch_tokens: int = BATCH_TOKEN_BUDGET,
+                preclassify_threshold: float | None = CONFIDENCE_THRESHOLD, job=None, resume: bool = True,
+                inbox=None, chunk_size: int = STREAM_CHUNK, group_threads: bool = True):
+    """
+    Categorizes every email of the inbox and pushes the results to the processed inbox.
+    Emails are sent to the model by up to `max_workers` threads, optionally throttled to
+    `requests_per_minute`. Results keep the order of the inbox.
+    With `use_cache`, emails whose content and prompts did not change since the last run
+    are served from the result cache instead of the model.
+    With `batch_size` > 1, up to that many emails share one request of at most
+    `max_batch_tokens`; entries missing from the answer are retried one by one.
+    Obvious newsletters and spam classified locally with at least `preclassify_threshold`
+    confidence skip the model, None sends every email to it.
+    `job` (see backend.jobs) receives the progress of every email and can cancel the run.
+    Emails that fail do not stop the others; their results are kept and an error is raised at the end.
+    Every result is appended to a checkpoint as soon as it is known. With `resume`, emails completed
+    by an interrupted or failed run are taken from it; the checkpoint is removed once all results are stored.
+    `inbox` is an optional iterable of inbox records (e.g. backend.extractor.extractMailbox.extract()),
+    consumed `chunk_size` emails at a time: each chunk is added to the inbox and its results
+    to the processed inbox before the next one is read, the other processed emails are kept.
+    With `group_threads`, each reply chain or near-duplicate cluster (see backend.threads) is sent
+    once, with the quoted history stripped, and its result is applied to all of its emails.
+    """
+    with metrics.stage("categorizer.run"):
+        run = _Run(max_workers, requests_per_minute, use_cache, batch_size, max_batch_tokens,
+                   preclassify_threshold, job, resume, group_threads)
+        result = run.stream(inbox, chunk_size) if inbox is not None else run.all()
+    metrics.write_prometheus()
+    return result
+
+
+class _Run:
+    # state shared by the chunks of one categorizer() call
+
+    def __init__(self, max_workers, requests_per_minute, use_cache, batch_size, max_batch_tokens,
+                 preclassify_threshold, job, resume, group_threads):
+        self.max_workers = max_workers
+        self.group_threads = group_threads
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.preclassify_threshold = preclassify_threshold
+        self.job = job
+        self.bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        with metrics.stage("categorizer.load"):
+            self.prompts = extractPrompts.extract()
+            self.cache = ResultCache() if use_cache else None
+            self.checkpoint = Checkpoint()
+            self.completed = self.checkpoint.load() if resume else {}
+        self.prompts_digest = prompts_hash(self.prompts)
+        self.llm = None
+        self.classifier = None
+        self.failures = []
+
+    def cancelled(self):
+        return bool(self.job and self.job.cancelled())
+
+    def all(self):
+        with metrics.stage("categorizer.load"):
+            inbox = extractInbox.extract()
+        # only the entries still matching an email of this run are carried over
+        keys = {(str(email["id"]), ResultCache.key(email, self.prompts_digest)) for email in inbox}
+        self.completed = {entry: result for entry, result in self.completed.items() if entry in keys}
+        # lines are flushed as they are written, nothing is lost if the run dies before closing it
+        self.checkpoint.open(self.completed)
+        categorized_emails = self.categorize(inbox)
+        self.save_cache()
+        if self.failures or self.cancelled():
+            return self.partial(categorized_emails)
+        result = pushInbox.pushIt(categorized_emails)
+        self.checkpoint.finalize()
+        return result
+
+    def stream(self, inbox, chunk_size):
+        # the emails to come are unknown, every checkpoint entry is kept
+        self.checkpoint.open(self.completed)
+        store = get_store()
+        for chunk in _chunks(inbox, chunk_size):
+            store.upsert_emails("inbox", chunk)
+            categorized_emails = self.categorize(chunk)
+            pushInbox.pushIt([email for email in categorized_emails if email is not None], replace=False)
+            self.save_cache()
+            if self.cancelled():
+                break
+        if self.failures or self.cancelled():
+            return self.partial([])
+        self.checkpoint.finalize()
+        return None
+
+    def partial(self, categorized_emails):
+        self.checkpoint.close()
+        # keep what was done without dropping the processed emails of the rest
+        if categorized_emails:
+            pushInbox.pushIt([email for email in categorized_emails if email is not None], replace=False)
+        if self.failures:
+            raise RuntimeError(f"{len(self.failures)} categorization request(s) failed, "
+                               f"first error: {self.failures[0]}") from self.failures[0]
+        return None
+
+    def save_cache(self):
+        if self.cache:
+            with metrics.stage("categorizer.cache_save"):
+                self.cache.save()
+
+    def preclassifier(self):
+        # trained once per run: the chunks of a stream push results, which must not retrain it every chunk
+        if self.classifier is None:
+            store = get_store()
+            self.classifier = get_preclassifier((store.path, store.version("processed")),
+                                                lambda: store.iter_fields("processed", TRAINING_FIELDS),
+                                                self.preclassify_threshold)
+        return self.classifier
+
+    def model(self):
+        if self.llm is None:
+            llm = chat_model(
+                model="gemini-2.5-flash-lite",
+                temperature=0,
+                max_tokens=None,
+                timeout=None,
+                # retries go through the shared scheduler, which knows about every other call
+                max_retries=0)
+            # the structured wrapper does not depend on the email, build it once
+            self.llm = (llm, llm.with_structured_output(CategorizedEmail, method="json_mode"))
+        return self.llm
+
+    def categorize(self, inbox):
+        """
+        Returns the categorized `inbox`, None in place of the emails that failed or were cancelled.
+        """
+        job, cache, checkpoint, User_prompts = self.job, self.cache, self.checkpoint, self.prompts
+        keys = [ResultCache.key(email, self.prompts_digest) for email in inbox]
+        if job:
+            job.start(len(inbox))
+
+        categorized_emails = [None] * len(inbox)
+
+        def finish(i, result, status, preclassified=False):
+            categorized_emails[i] = merge_result(inbox[i], result)
+            # emails labelled locally are marked, the preclassifier is not trained on them
+            categorized_emails[i].preclassified = preclassified
+            if status != "resumed":
+                checkpoint.append(inbox[i]["id"], keys[i], {**result.model_dump(), "preclassified": preclassified})
+            if job:
+                job.update(inbox[i]["id"], status, pushInbox.to_record(categorized_emails[i]))
+
+        pending = []
+        resumed = 0
+        with metrics.stage("categorizer.cache_lookup"):
+            for i, email in enumerate(inbox):
+                done = self.completed.get((str(email["id"]), keys[i]))
+                if done is not None:
+                    finish(i, CategorizedEmail(**done), "resumed", bool(done.get("preclassified")))
+                    resumed += 1
+                    continue
+                cached = cache.get(keys[i]) if cache else None
+                if cached is not None:
+                    finish(i, CategorizedEmail(**cached), "cached")
+                else:
+                    pending.append(i)
+        metrics.increment("categorizer_resumed", resumed)
+        metrics.increment("categorizer_cache_hits", len(inbox) - len(pending) - resumed)
+
+        if pending and self.preclassify_threshold is not None:
+            with metrics.stage("categorizer.preclassify"):
+                classifier = self.preclassifier()
+                uncertain = []
+                for i in pending:
+                    local = classifier.classify(inbox[i])
+                    if local is not None:
+                        finish(i, local, "local", True)
+                    else:
+                        uncertain.append(i)
+            metrics.increment("categorizer_fast_path", len(pending) - len(uncertain))
+            pending = uncertain
+
+        if not pending:
+            return categorized_emails
+
+        # one request per thread or near-duplicate cluster, its result is applied to every member
+        if self.group_threads:
+            with metrics.stage("categorizer.grouping"):
+                groups = [[pending[j] for j in group] for group in group_emails([inbox[i] for i in pending])]
+                requests = [representative(inbox, group) for group in groups]
+            metrics.increment("categorizer_grouped", len(pending) - len(groups))
+        else:
+            groups = [[i] for i in pending]
+            requests = [inbox[i] for i in pending]
+
+        llm, str_llm_json = self.model()
+        bucket = self.bucket
+
+        def categorize_one(g):
+            with metrics.stage("categorizer.prompt_build"):
+                prompt = build_prompt(requests[g], User_prompts)
+            if bucket:
+                with metrics.stage("categorizer.rate_limit_wait"):
+                    bucket.acquire()
+            with metrics.stage("categorizer.model"):
+                return scheduler.call(lambda: str_llm_json.invoke(prompt), BATCH)
+
+        def categorize_unit(unit):
+            if self.cancelled():
+                return None
+            if len(unit) == 1:
+                return [categorize_one(unit[0])]
+            emails = [requests[g] for g in unit]
+            with metrics.stage("categorizer.prompt_build"):
+                prompt = build_batch_prompt(emails, User_prompts)
+            if bucket:
+                with metrics.stage("categorizer.rate_limit_wait"):
+                    bucket.acquire()
+            with metrics.stage("categorizer.model"):
+                response = scheduler.call(lambda: llm.invoke(prompt), BATCH)
+            with metrics.stage("categorizer.validation"):
+                parsed = parse_batch(response, emails)
+            # entries that failed validation are retried one by one
+            metrics.increment("categorizer_validation_retries", len(unit) - len(parsed))
+            return [parsed.get(str(requests[g]["id"])) or categorize_one(g) for g in unit]
+
+        def collect(unit, future_result):
+            # runs on the calling thread only, so the cache and the result list need no lock
+            try:
+                unit_results = future_result()
+            except Exception as e:
+                self.failures.append(e)
+                for g in unit:
+                    for i in groups[g]:
+                        if job:
+                            job.update(inbox[i]["id"], "failed")
+                return
+            if unit_results is None:
+                return
+            for g, result in zip(unit, unit_results):
+                for i in groups[g]:
+                    finish(i, result, "done")
+                    if cache:
+                        cache.put(keys[i], result.model_dump())
+
+        if self.batch_size > 1:
+            overhead = estimate_tokens(build_batch_prompt([], User_prompts))
+            units = make_batches(requests, self.batch_size, self.max_batch_tokens, overhead)
+        else:
+            units = [[g] for g in range(len(requests))]
+
+        if self.max_workers <= 1:
+            for unit in units:
+                collect(unit, lambda: categorize_unit(unit))
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                futures = {pool.submit(categorize_unit, unit): unit for unit in units}
+                # results land in their inbox slot, so completion order does not matter
+                for future in as_completed(futures):
+                    collect(futures[future], future.result)
+                    if self.cancelled():
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        break
+        return categorized_emails
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
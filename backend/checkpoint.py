@@ -0,0 +1,80 @@
+import json
+import os
+import threading
+
+from backend.mailboxes import mailbox_path
+
+#append-only log of categorizer results, so a crashed or restarted run only redoes the unfinished emails
+
+# kept in the folder of the current mailbox
+CheckpointFile = "categorizer_checkpoint.jsonl"
+# results flushed to disk at least every this many lines
+FSYNC_EVERY = 100
+
+
+class Checkpoint:
+    """
+    One JSON line per categorized email: {"id", "key", "result"}. `key` is the content and
+    prompts hash of the email, a result is only reused while the email and prompts are unchanged.
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = path or mailbox_path(CheckpointFile)
+        self.file = None
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        Returns {(id, key): result} of the completed emails. A line cut short by a crash is dropped.
+        """
+        done = {}
+        if not os.path.exists(self.path):
+            return done
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    done[(str(entry["id"]), entry["key"])] = entry["result"]
+                except (ValueError, KeyError, TypeError):
+                    continue
+        return done
+
+    def open(self, keep=None):
+        """
+        Starts appending. `keep` is the {(id, key): result} to carry over from the previous run,
+        the file is rewritten atomically with only them; None starts a new checkpoint.
+        """
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            for (email_id, key), result in (keep or {}).items():
+                f.write(json.dumps({"id": email_id, "key": key, "result": result}) + "\n")
+        os.replace(tmp, self.path)
+        self.file = open(self.path, "a")
+        return self
+
+    def append(self, email_id, key, result):
+        line = json.dumps({"id": str(email_id), "key": key, "result": result}) + "\n"
+        with self.lock:
+            # a single write per line, a crash leaves at most the last line incomplete
+            self.file.write(line)
+            self.file.flush()
+            self.pending += 1
+            if self.pending >= FSYNC_EVERY:
+                os.fsync(self.file.fileno())
+                self.pending = 0
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.file.close()
+                self.file = None
+                self.pending = 0
+
+    def finalize(self):
+        # the results are in the mailbox store, the checkpoint is no longer needed
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,54 @@
+import os
+import threading
+from collections import OrderedDict
+
+#process wide cache of parsed data and derived frames, keyed on the stat of the files they come from
+
+# entries kept across every session and mailbox, the least recently used one is dropped first
+MAX_ENTRIES = 64
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+
+
+def file_signature(*paths):
+    # (path, mtime, size) of every file, missing files count as None
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append((path, None))
+    return tuple(signature)
+
+
+def cached(key, signature, loader):
+    """
+    Returns the value stored under `key` if it was loaded with the same `signature`,
+    otherwise calls `loader()` and stores its result. At most MAX_ENTRIES values are kept.
+    """
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry[0] == signature:
+            _entries.move_to_end(key)
+            return entry[1]
+    value = loader()
+    with _lock:
+        _entries[key] = (signature, value)
+        _entries.move_to_end(key)
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+    return value
+
+
+def invalidate(prefix=None):
+    """
+    Drops every entry, or only the ones whose key is a tuple starting with `prefix`.
+    """
+    with _lock:
+        if prefix is None:
+            _entries.clear()
+            return
+        for key in [k for k in _entries if isinstance(k, tuple) and k[:1] == (prefix,)]:
+            del _entries[key]
@@ -0,0 +1,111 @@
+import re
+from datetime import date, datetime, timedelta
+
+#finds the due date in action item text ("by EOD Friday", "November 21", "2024-11-22"), relative to the email date
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+MONTHS = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
+
+# whole month names or their abbreviations only: "decks", "maybe" or "junior" are not months
+_MONTH = (r"(jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?|sep(?:t(?:ember)?)?"
+          r"|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)(?:\.|\b)")
+_DAY = r"(\d{1,2})(?:st|nd|rd|th)?"
+PATTERNS = [
+    ("iso", re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")),
+    ("month_day", re.compile(rf"\b{_MONTH}\s+{_DAY}\b(?:,?\s*(\d{{4}}))?", re.IGNORECASE)),
+    ("day_month", re.compile(rf"\b{_DAY}\s+(?:of\s+)?{_MONTH}(?:,?\s*(\d{{4}}))?", re.IGNORECASE)),
+    ("slash", re.compile(r"\b(\d{1,2})/(\d{1,2})(?:/(\d{2,4}))?\b")),
+    ("today", re.compile(r"\b(today|tonight|eod|end of (the )?day|cob|close of business|asap)\b", re.IGNORECASE)),
+    ("tomorrow", re.compile(r"\btomorrow\b", re.IGNORECASE)),
+    ("end_of_week", re.compile(r"\b(end of (the |this )?week|eow)\b", re.IGNORECASE)),
+    ("next_week", re.compile(r"\bnext week\b", re.IGNORECASE)),
+    ("end_of_month", re.compile(r"\bend of (the |this )?month\b", re.IGNORECASE)),
+    ("weekday", re.compile(r"\b(next\s+)?(monday|tuesday|wednesday|thursday|friday|saturday|sunday)\b", re.IGNORECASE)),
+]
+# "EOD Friday, November 22": a written date beats a weekday, which beats "end of day"
+SPECIFICITY = {"iso": 0, "month_day": 0, "day_month": 0, "slash": 0, "today": 2}
+
+
+def reference_date(timestamp) -> date:
+    """
+    Returns the date of an email timestamp ("2024-11-18T09:30:00Z"), today when it is missing or invalid.
+    """
+    if isinstance(timestamp, datetime):
+        return timestamp.date()
+    if isinstance(timestamp, date):
+        return timestamp
+    try:
+        return datetime.fromisoformat(str(timestamp).replace("Z", "+00:00")).date()
+    except ValueError:
+        return date.today()
+
+
+def _month_day(reference, month, day, year=None):
+    try:
+        found = date(int(year) if year else reference.year, month, int(day))
+    except ValueError:
+        return None
+    # "January 5" written in December is next year's
+    if not year and found < reference - timedelta(days=180):
+        found = found.replace(year=found.year + 1)
+    return found
+
+
+def _match_date(kind, match, reference):
+    if kind == "iso":
+        try:
+            return date(int(match[1]), int(match[2]), int(match[3]))
+        except ValueError:
+            return None
+    if kind == "month_day":
+        return _month_day(reference, MONTHS.index(match[1].lower()[:3]) + 1, match[2], match[3])
+    if kind == "day_month":
+        return _month_day(reference, MONTHS.index(match[2].lower()[:3]) + 1, match[1], match[3])
+    if kind == "slash":
+        year = match[3]
+        if year and len(year) == 2:
+            year = "20" + year
+        if int(match[1]) > 12:
+            return None
+        return _month_day(reference, int(match[1]), match[2], year)
+    if kind == "today":
+        return reference
+    if kind == "tomorrow":
+        return reference + timedelta(days=1)
+    if kind == "end_of_week":
+        return reference + timedelta(days=(4 - reference.weekday()) % 7)
+    if kind == "next_week":
+        return reference + timedelta(days=7 - reference.weekday() + 4)
+    if kind == "end_of_month":
+        following = (reference.replace(day=28) + timedelta(days=4)).replace(day=1)
+        return following - timedelta(days=1)
+    if kind == "weekday":
+        weekday = WEEKDAYS.index(match[2].lower())
+        if match[1]:
+            # "next Monday" is the Monday of next week
+            return reference + timedelta(days=7 - reference.weekday() + weekday)
+        # "by Friday" written on a Friday means the next one
+        return reference + timedelta(days=(weekday - reference.weekday()) % 7 or 7)
+    return None
+
+
+def parse_deadline(text: str, reference=None) -> date | None:
+    """
+    Returns the earliest of the most specific due dates mentioned in `text`, resolving relative
+    dates against `reference` (an email timestamp or date), or None when it mentions no date.
+    """
+    if not text:
+        return None
+    reference = reference_date(reference)
+    found = []
+    spans = []
+    for kind, pattern in PATTERNS:
+        for match in pattern.finditer(text):
+            # text already read as a date is not matched again ("5/11" inside "2024-5-11")
+            if any(start <= match.start() < end or match.start() <= start < match.end() for start, end in spans):
+                continue
+            when = _match_date(kind, match, reference)
+            if when is not None:
+                found.append((SPECIFICITY.get(kind, 1), when))
+                spans.append(match.span())
+    return min(found)[1] if found else None
@@ -0,0 +1,183 @@
+import re
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+from backend.extractor import extractPrompts
+from backend.ratelimit import TokenBucket
+from backend.llm import chat_model
+from backend.metrics import metrics
+from backend.store import get_store
+from backend.emailtable import get_email_table
+from backend.scheduler import scheduler, BATCH
+
+load_dotenv()
+
+#generates reply drafts for many processed emails at once and saves them in one transaction
+
+# default number of drafts generated at the same time
+MAX_WORKERS = 4
+DEFAULT_CATEGORIES = ("To-Do", "Meeting Request")
+NO_REPLY_SENDER = re.compile(r"^(no-?reply|do-?not-?reply|mailer-daemon|postmaster|bounces?)[@+.-]", re.IGNORECASE)
+
+
+def needs_reply(email):
+    # spam and automated senders never get a draft
+    if email.get("is_spam") or str(email.get("category") or "").lower() == "spam":
+        return False
+    return not NO_REPLY_SENDER.search(str(email.get("sender") or ""))
+
+
+def select_positions(categories=DEFAULT_CATEGORIES, priorities=None, include_drafted: bool = False):
+    """
+    Returns the positions in the shared email table of the processed emails of `categories` and
+    `priorities` (None for any) that should get a reply, leaving out the ones that already have
+    a saved draft unless `include_drafted`. No body is read.
+    """
+    table = get_email_table()
+    drafted = set() if include_drafted else {str(d.get("related_email_id")) for d in get_store().drafts() if d.get("related_email_id")}
+    selected, seen = [], set()
+    for category in categories or [None]:
+        for priority in priorities or [None]:
+            positions = table.select(category=category, priority=priority)
+            for position, email in zip(positions, table.records(positions)):
+                email_id = str(email.get("id"))
+                if email_id in seen or email_id in drafted or not needs_reply(email):
+                    continue
+                seen.add(email_id)
+                selected.append(position)
+    return selected
+
+
+def select_emails(categories=DEFAULT_CATEGORIES, priorities=None, include_drafted: bool = False):
+    """
+    Returns the emails of select_positions(categories, priorities, include_drafted), bodies included.
+    """
+    # only the selected emails are read in full
+    return get_email_table().emails(select_positions(categories, priorities, include_drafted))
+
+
+def build_draft_prompt(email, User_prompts, instructions=None):
+    return f"""You are an Email Drafting Agent. Draft a reply to the email below.
+
+DRAFTING REPLIES GUIDELINE: {User_prompts.get("auto_reply_prompt", "Keep it concise, polite and professional.")}
+{f"Instructions: {instructions}" if instructions else ""}
+
+From: {email.get('sender')} ({email.get('sender_name')})
+Subject: {email.get('subject')}
+Date: {email.get('timestamp')}
+Body:
+{email.get('body')}
+
+IMPORTANT: Return the draft in the following format:
+Subject: [Subject Line]
+
+[Body Text]"""
+
+
+def parse_draft(response, default_subject="Draft Subject"):
+    """
+    Splits a "Subject: ...\\n\\nbody" answer into (subject, body).
+    """
+    subject, body = default_subject, response
+    if "Subject:" in response:
+        parts = response.split("\n", 1)
+        if parts and parts[0].startswith("Subject:"):
+            subject = parts[0].replace("Subject:", "").strip()
+            body = parts[1].strip() if len(parts) > 1 else ""
+    return subject, body
+
+
+def make_draft(email, subject, body):
+    return {
+        "id": str(uuid.uuid4()),
+        "type": "Reply to Email",
+        "related_email_id": email.get("id"),
+        "subject": subject,
+        "body": body,
+        "status": "generated",
+    }
+
+
+def bulk_drafts(categories=DEFAULT_CATEGORIES, priorities=None, max_workers: int = MAX_WORKERS,
+                requests_per_minute: float | None = None, instructions: str | None = None,
+                reuse_reply_drafts: bool = True, job=None):
+    """
+    Generates a reply draft for every email returned by select_emails(categories, priorities)
+    with up to `max_workers` model calls at a time, optionally throttled to `requests_per_minute`.
+    With `reuse_reply_drafts`, the reply drafted during categorization is used when there is one
+    and no `instructions` are given. All drafts are saved in one transaction, linked to their
+    email by related_email_id; drafts that succeeded are saved even when others failed.
+    `job` (see backend.jobs) receives the progress of every email and can cancel the run.
+    """
+    with metrics.stage("drafter.run"):
+        return _bulk_drafts(categories, priorities, max_workers, requests_per_minute, instructions,
+                            reuse_reply_drafts, job)
+
+
+def _bulk_drafts(categories, priorities, max_workers, requests_per_minute, instructions, reuse_reply_drafts, job):
+    with metrics.stage("drafter.select"):
+        emails = select_emails(categories, priorities)
+        User_prompts = extractPrompts.extract()
+    if job:
+        job.start(len(emails))
+
+    drafts, pending, failures = [], [], []
+
+    def finish(email, draft, status):
+        drafts.append(draft)
+        if job:
+            job.update(email["id"], status, {"id": email["id"], "subject": draft["subject"],
+                                             "to": email.get("sender"), "body": draft["body"][:200]})
+
+    for email in emails:
+        if reuse_reply_drafts and not instructions and email.get("reply_draft"):
+            finish(email, make_draft(email, f"Re: {email.get('subject')}", email["reply_draft"]), "reused")
+        else:
+            pending.append(email)
+    metrics.increment("drafter_reused", len(emails) - len(pending))
+
+    if pending:
+        llm = chat_model(
+            model="gemini-2.5-flash",
+            temperature=0.3,
+            # retries go through the shared scheduler
+            max_retries=0)
+        bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+
+        def draft_one(email):
+            if job and job.cancelled():
+                return None
+            prompt = build_draft_prompt(email, User_prompts, instructions)
+            if bucket:
+                with metrics.stage("drafter.rate_limit_wait"):
+                    bucket.acquire()
+            with metrics.stage("drafter.model"):
+                response = scheduler.call(lambda: llm.invoke(prompt), BATCH)
+            return make_draft(email, *parse_draft(response.text, f"Re: {email.get('subject')}"))
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            futures = {pool.submit(draft_one, email): email for email in pending}
+            for future in as_completed(futures):
+                email = futures[future]
+                try:
+                    draft = future.result()
+                except Exception as e:
+                    failures.append(e)
+                    if job:
+                        job.update(email["id"], "failed")
+                    continue
+                if draft is not None:
+                    finish(email, draft, "done")
+                if job and job.cancelled():
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    break
+
+    # one write for the whole batch, in the order of the selection
+    order = {str(email["id"]): i for i, email in enumerate(emails)}
+    drafts.sort(key=lambda draft: order[str(draft["related_email_id"])])
+    if drafts:
+        with metrics.stage("drafter.save"):
+            get_store().save_drafts(drafts)
+    if failures:
+        raise RuntimeError(f"{len(failures)} of {len(emails)} drafts failed, first error: {failures[0]}") from failures[0]
+    return drafts
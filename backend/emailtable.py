@@ -0,0 +1,140 @@
+import json
+import threading
+
+import numpy as np
+import pandas as pd
+
+from backend.store import get_store
+from backend.metrics import metrics
+
+#the processed inbox as one columnar table, built once per data version and shared by the agent, the tools and the UI
+
+# every field except the body, which is loaded per email when it is shown
+COLUMNS = ("id", "message_id", "sender", "sender_name", "recipients", "subject", "timestamp", "category", "priority",
+           "is_spam", "action_items", "summary", "has_attachment", "attachment_names")
+# few distinct values, stored once with an integer code per row
+CATEGORICAL = ("sender", "sender_name", "category", "priority")
+LISTS = ("recipients", "attachment_names")
+FLAGS = ("is_spam", "has_attachment")
+# ids keep the type they were stored with, the other text is held in pandas string columns
+OBJECTS = ("id",)
+SEARCHED = ("subject", "sender", "sender_name")
+
+
+class EmailTable:
+    """
+    Processed emails as a pandas frame, one row per email in inbox order. sender, sender_name,
+    category and priority are categoricals, bodies stay in the store until email() asks for them.
+    Filters return row positions; the frame is shared, callers read it and never modify it.
+    """
+
+    def __init__(self, columns, table: str = "processed", store=None):
+        self.table = table
+        self.store = store or get_store()
+        self.keys = np.array(columns.pop("key"), dtype=object)
+        frame = pd.DataFrame({name: pd.Series(columns[name], dtype=object) for name in COLUMNS})
+        for name in COLUMNS:
+            if name in CATEGORICAL:
+                frame[name] = frame[name].astype("category")
+            elif name in FLAGS:
+                frame[name] = frame[name].fillna(False).astype(bool)
+            elif name not in OBJECTS:
+                frame[name] = frame[name].astype("string")
+        self.frame = frame
+
+    @classmethod
+    def load(cls, table: str = "processed", store=None):
+        store = store or get_store()
+        return cls(store.columns(table, COLUMNS), table, store)
+
+    def __len__(self):
+        return len(self.frame)
+
+    def values(self, column):
+        # the distinct non-empty values of a categorical column that occur in some row
+        series = self.frame[column]
+        return sorted(str(value) for value in series.cat.categories[np.unique(series.cat.codes[series.cat.codes >= 0])]
+                      if str(value))
+
+    def _equals(self, column, value):
+        series = self.frame[column]
+        if value not in series.cat.categories:
+            return np.zeros(len(series), dtype=bool)
+        # compares the integer codes, not the strings
+        return (series.cat.codes == series.cat.categories.get_loc(value)).to_numpy()
+
+    def select(self, category=None, priority=None, sender=None, search=None, action_items=None):
+        """
+        Returns the positions of the rows matching every given filter, in inbox order.
+        `search` is a case-insensitive substring of the subject, sender or sender name,
+        `action_items` keeps only the emails that have (True) or lack (False) action items.
+        """
+        mask = np.ones(len(self.frame), dtype=bool)
+        for column, value in (("category", category), ("priority", priority), ("sender", sender)):
+            if value is not None:
+                mask &= self._equals(column, value)
+        if search:
+            needle = search.lower()
+            found = np.zeros(len(self.frame), dtype=bool)
+            for column in SEARCHED:
+                series = self.frame[column]
+                if isinstance(series.dtype, pd.CategoricalDtype):
+                    # each distinct sender is tested once
+                    hits = [i for i, value in enumerate(series.cat.categories) if needle in str(value).lower()]
+                    found |= np.isin(series.cat.codes.to_numpy(), hits)
+                else:
+                    found |= series.str.contains(needle, case=False, regex=False, na=False).to_numpy()
+            mask &= found
+        if action_items is not None:
+            items = self.frame["action_items"]
+            has = (items.notna() & (items.astype(str).str.strip() != "")).to_numpy()
+            mask &= has if action_items else ~has
+        return np.flatnonzero(mask)
+
+    def records(self, positions=None):
+        """
+        Returns the emails at `positions` (all by default) as dicts without their bodies.
+        """
+        frame = self.frame if positions is None else self.frame.take(np.asarray(positions, dtype=int))
+        # converted a column at a time, not a row at a time
+        values = []
+        for name in COLUMNS:
+            column = frame[name].tolist()
+            if name in LISTS:
+                column = [json.loads(v) if isinstance(v, str) else [] for v in column]
+            elif name not in FLAGS:
+                column = [None if v is None or (not isinstance(v, (str, int)) and pd.isna(v)) else v for v in column]
+            values.append(column)
+        return [dict(zip(COLUMNS, row)) for row in zip(*values)]
+
+    def record(self, position):
+        return self.records([position])[0]
+
+    def emails(self, positions):
+        """
+        Returns the full stored emails, bodies included, at `positions`.
+        """
+        return self.store.get_emails(self.table, self.keys[np.asarray(positions, dtype=int)])
+
+    def email(self, position):
+        found = self.emails([position])
+        return found[0] if found else self.record(position)
+
+
+# database path -> (version, table), one per mailbox
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def get_email_table():
+    """
+    Returns the EmailTable of the processed inbox of the current mailbox, reloaded only when it changed.
+    """
+    store = get_store()
+    version = store.version("processed")
+    with _tables_lock:
+        loaded = _tables.get(store.path)
+        if loaded is None or loaded[0] != version:
+            with metrics.stage("emailtable.load"):
+                loaded = _tables[store.path] = (version, EmailTable.load("processed", store))
+    return loaded[1]
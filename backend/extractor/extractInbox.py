@@ -1,11 +1,10 @@
 
-import json
-#extracts inbox data from json
+from backend.store import get_store
+from backend.metrics import metrics
+#extracts inbox data from the mailbox store (sources/inbox.json is imported whenever it changes)
+@metrics.timed("extractInbox.extract")
 def extract():
-    InboxFile = "sources/inbox.json"
-    with open(InboxFile,"r") as f:
-        raw = json.load(f)
-    emails = raw["emails"]
+    emails = get_store().emails("inbox")
     return emails
 
-# extract()
\ No newline at end of file
+# extract()
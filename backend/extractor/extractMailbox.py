@@ -0,0 +1,286 @@
+import hashlib
+import html
+import itertools
+import os
+import re
+from email import policy
+from email.feedparser import BytesFeedParser
+from email.parser import BytesParser
+from email.utils import getaddresses, parseaddr, parsedate_to_datetime
+from datetime import timezone
+
+from backend.metrics import metrics
+
+#streams mbox files and Maildir directories as inbox records, one message in memory at a time
+
+MBOX_FROM = re.compile(rb"^>+From ")
+TAGS = re.compile(r"<(script|style)\b.*?</\1\s*>|<[^>]+>", re.IGNORECASE | re.DOTALL)
+BLANK_LINES = re.compile(r"\n\s*\n+")
+BOUNDARY = re.compile(rb"^--(.+?)(--)?[ \t]*\r?\n?$")
+# set on the parts whose payload was skipped, holds the size of the decoded payload
+SIZE_HEADER = "X-Skipped-Payload-Size"
+
+_parser = BytesParser(policy=policy.default)
+
+
+class _MessageFeed:
+    """
+    Feeds the lines of one message to a BytesFeedParser, dropping the payload of every part that
+    is not text (attachments, images) on the way and recording its size in SIZE_HEADER instead.
+    Memory stays bounded by the text of the message, whatever its attachments weigh.
+    """
+
+    def __init__(self):
+        self.parser = BytesFeedParser(policy=policy.default)
+        self.boundaries = []
+        # "headers" of the message or a part are held until they are complete, then its body
+        # is either fed ("text") or skipped ("skip")
+        self.state = "headers"
+        self.head = []
+        self.base64 = False
+        self.size = 0
+        self.padding = 0
+
+    def feed(self, line):
+        if self.state == "headers":
+            self.head.append(line)
+            if line in (b"\n", b"\r\n"):
+                self._part_started()
+            return
+        match = BOUNDARY.match(line) if self.boundaries else None
+        if match and match.group(1) in self.boundaries:
+            if self.state == "skip":
+                self._flush_skipped()
+            self.parser.feed(line)
+            if match.group(2):
+                # closing boundary: back to the epilogue of the enclosing multipart
+                del self.boundaries[self.boundaries.index(match.group(1)):]
+                self.state = "text"
+            else:
+                self.state = "headers"
+            return
+        if self.state == "text":
+            self.parser.feed(line)
+        elif self.base64:
+            data = line.strip()
+            self.size += len(data)
+            self.padding = data.count(b"=") if data else self.padding
+        else:
+            self.size += len(line)
+
+    def _part_started(self):
+        part = _parser.parsebytes(b"".join(self.head), headersonly=True)
+        if part.get_content_maintype() == "multipart":
+            boundary = part.get_boundary()
+            if boundary:
+                self.boundaries.append(boundary.encode("utf-8", errors="replace"))
+        elif part.get_content_maintype() == "message":
+            # an attached message: its own headers follow
+            self.parser.feed(b"".join(self.head))
+            self.head = []
+            return
+        if part.get_content_maintype() in ("multipart", "text") and part.get_content_disposition() != "attachment":
+            self.parser.feed(b"".join(self.head))
+            self.head = []
+            self.state = "text"
+        else:
+            self.state = "skip"
+            self.base64 = str(part.get("Content-Transfer-Encoding", "")).strip().lower() == "base64"
+            self.size = self.padding = 0
+
+    def _flush_skipped(self):
+        size = max(0, self.size * 3 // 4 - self.padding) if self.base64 else self.size
+        blank = self.head.pop()
+        self.parser.feed(b"".join(self.head) + f"{SIZE_HEADER}: {size}".encode("ascii") + blank)
+        self.parser.feed(blank)
+        self.head = []
+
+    def close(self):
+        if self.state == "skip":
+            self._flush_skipped()
+        elif self.head:
+            self.parser.feed(b"".join(self.head))
+        return self.parser.close()
+
+
+def _parse_file(f):
+    feed = _MessageFeed()
+    for line in f:
+        feed.feed(line)
+    return feed.close()
+
+
+def extract(path: str):
+    """
+    Yields the messages of the mbox file or Maildir directory at `path` as inbox records.
+    Only one message is held at a time and attachments are measured without being decoded,
+    so memory stays bounded by the largest message, not by the mailbox.
+    """
+    messages = _maildir_messages(path) if os.path.isdir(path) else _mbox_messages(path)
+    for fallback_id, message in messages:
+        metrics.increment("ingested_emails")
+        yield to_record(message, fallback_id)
+
+
+def ingest(path: str, chunk_size: int = 500):
+    """
+    Adds the messages at `path` to the inbox of the mailbox store, `chunk_size` at a time,
+    without categorizing them. Returns the number of messages read.
+    """
+    from backend.store import get_store
+    store = get_store()
+    records = extract(path)
+    count = 0
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if not chunk:
+            return count
+        store.upsert_emails("inbox", chunk)
+        count += len(chunk)
+
+
+def _mbox_messages(path):
+    name = os.path.basename(path)
+    with open(path, "rb") as f:
+        feed = None
+        count = 0
+        previous_blank = True
+        # the blank line before the next "From " separator belongs to the mbox, not the message
+        pending_blank = None
+        for line in f:
+            blank = line in (b"\n", b"\r\n")
+            if line.startswith(b"From ") and previous_blank:
+                if feed is not None:
+                    yield f"{name}:{count}", feed.close()
+                    count += 1
+                feed = _MessageFeed()
+                pending_blank = None
+            elif feed is not None:
+                if pending_blank is not None:
+                    feed.feed(pending_blank)
+                    pending_blank = None
+                if blank:
+                    pending_blank = line
+                else:
+                    # mboxrd escapes body lines starting with "From "
+                    feed.feed(line[1:] if MBOX_FROM.match(line) else line)
+            previous_blank = blank
+        if feed is not None:
+            yield f"{name}:{count}", feed.close()
+
+
+def _maildir_messages(path):
+    for folder in ("new", "cur"):
+        directory = os.path.join(path, folder)
+        if not os.path.isdir(directory):
+            continue
+        # scandir does not build the whole listing, large Maildirs are walked lazily
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                with open(entry.path, "rb") as f:
+                    message = _parse_file(f)
+                # the part after ":" holds the Maildir flags and changes when a message is read
+                yield entry.name.split(":", 1)[0], message
+
+
+def _header(message, name):
+    try:
+        return str(message.get(name) or "").strip()
+    except (ValueError, TypeError, IndexError):
+        # header too malformed to decode
+        return ""
+
+
+def _timestamp(value):
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return ""
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _html_text(markup):
+    text = html.unescape(TAGS.sub(" ", re.sub(r"(?i)<br\s*/?>|</p>", "\n", markup)))
+    return BLANK_LINES.sub("\n\n", "\n".join(line.strip() for line in text.splitlines())).strip()
+
+
+def _text(part):
+    try:
+        return part.get_content()
+    except (LookupError, ValueError, AssertionError):
+        # unknown charset or broken encoding, decode what can be decoded
+        payload = part.get_payload(decode=True) or b""
+        return payload.decode("utf-8", errors="replace")
+
+
+def _encoded_size(part):
+    # size of the decoded attachment, computed from the encoded text without decoding it
+    if part.get(SIZE_HEADER, "").isdigit():
+        return int(part[SIZE_HEADER])
+    payload = part.get_payload(decode=False)
+    if not isinstance(payload, str):
+        return 0
+    if str(part.get("Content-Transfer-Encoding", "")).strip().lower() == "base64":
+        data = "".join(payload.split())
+        return max(0, len(data) * 3 // 4 - data[-2:].count("="))
+    return len(payload.encode("utf-8", errors="replace"))
+
+
+def _body_and_attachments(message):
+    plain, markup = None, None
+    names, sizes = [], []
+    for part in message.walk():
+        if part.is_multipart():
+            continue
+        filename = part.get_filename()
+        disposition = part.get_content_disposition()
+        if disposition == "attachment" or filename or part.get_content_maintype() != "text":
+            # unnamed inline parts (signatures, tracking pixels) are not attachments
+            if filename or disposition == "attachment":
+                names.append(filename or "attachment")
+                sizes.append(_encoded_size(part))
+            continue
+        if part.get_content_type() == "text/plain" and plain is None:
+            plain = _text(part)
+        elif part.get_content_type() == "text/html" and markup is None:
+            markup = _text(part)
+    if plain is None and markup is not None:
+        plain = _html_text(markup)
+    return (plain or "").strip(), names, sizes
+
+
+def to_record(message, fallback_id: str):
+    """
+    Returns the inbox record (same fields as sources/inbox.json) of a parsed email message.
+    """
+    message_id = _header(message, "Message-ID")
+    sender_name, sender = parseaddr(_header(message, "From"))
+    recipients = [address for _, address in getaddresses([_header(message, "To"), _header(message, "Cc")]) if address]
+    body, attachment_names, attachment_sizes = _body_and_attachments(message)
+    return {
+        # stable across runs, so re-ingesting a mailbox updates the same emails
+        "id": "msg_" + hashlib.sha1((message_id or fallback_id).encode("utf-8")).hexdigest()[:16],
+        "message_id": message_id or f"<{fallback_id}>",
+        # thread links, used by backend.threads
+        "in_reply_to": _header(message, "In-Reply-To") or None,
+        "references": _header(message, "References").split(),
+        "sender": sender,
+        "sender_name": sender_name or sender,
+        "recipients": recipients,
+        "subject": _header(message, "Subject") or "No Subject",
+        "body": body,
+        "timestamp": _timestamp(_header(message, "Date")),
+        "category": None,
+        "priority": None,
+        "is_spam": False,
+        "sentiment": None,
+        "action_items": None,
+        "summary": None,
+        "has_attachment": bool(attachment_names),
+        "attachment_names": attachment_names,
+        "attachment_sizes": attachment_sizes,
+    }
@@ -1,7 +1,7 @@
-import json
-#extracts user defined prompts from json files
+from backend.store import get_store
+from backend.metrics import metrics
+#extracts user defined prompts from the mailbox store
+@metrics.timed("extractPrompts.extract")
 def extract():
-    PromptsFile = "sources/prompts.json"
-    with open(PromptsFile,"r") as f:
-        raw = json.load(f)
+    raw = get_store().prompts()
     return raw
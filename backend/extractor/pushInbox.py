@@ -1,13 +1,11 @@
-import json
 from backend.structure import Email
+from backend.store import get_store
+from backend.metrics import metrics
 
-#pushes extracted and processed data into processed inbox json 
+#pushes extracted and processed data into the processed table of the mailbox store
 
-def pushIt(emails : list):
-    data = list()
-    file = "sources/processed_inbox.json"
-    for email in emails:
-        data.append({
+def to_record(email : Email):
+    return {
         "id": email.id,
         "message_id": email.message_id,
         "sender": email.sender,
@@ -22,8 +20,18 @@ def pushIt(emails : list):
         "action_items": email.action_items,
         "summary": email.summary,
         "has_attachment": email.has_attachment,
-        "attachment_names": email.attachment_names
-        })
-    
-    with open(file, 'w') as file:
-        json.dump(data,file, indent=4) # indent for pretty-printing
+        "attachment_names": email.attachment_names,
+        "reply_draft": email.reply_draft,
+        "preclassified": email.preclassified
+        }
+
+@metrics.timed("pushInbox.pushIt")
+def pushIt(emails : list, replace: bool = True):
+    # replace=False only upserts `emails` and keeps the other processed emails
+    data = [to_record(email) for email in emails]
+
+    # rows are upserted, unchanged emails are not rewritten
+    if replace:
+        get_store().replace_emails("processed", data)
+    else:
+        get_store().upsert_emails("processed", data)
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from typing import Any, Iterator, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.output_parsers import PydanticOutputParser
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import PrivateAttr
+
+from backend.structure import CategorizedEmail
+
+#deterministic stand-in for ChatGoogleGenerativeAI, used by the benchmarks and for offline runs
+
+CATEGORIES = ["Important", "To-Do", "Meeting Request", "Project Update", "Newsletter", "Spam", "Personal"]
+PRIORITIES = ["High", "Medium", "Low"]
+
+EMAIL_HEADER = re.compile(r"--- EMAIL (.+?) ---")
+
+
+class FakeLLMError(RuntimeError):
+    pass
+
+
+def _text(messages):
+    return "\n".join(m.text if isinstance(m, BaseMessage) else str(m) for m in messages)
+
+
+def _rng(text):
+    # same prompt, same answer
+    return random.Random(hashlib.sha256(text.encode("utf-8")).hexdigest())
+
+
+def fake_fields(schema, text):
+    """
+    Returns a dict of values valid for the pydantic `schema`, derived from `text`.
+    """
+    rng = _rng(text)
+    category = rng.choice(CATEGORIES)
+    values = {}
+    for name, field in schema.model_fields.items():
+        if name == "category":
+            values[name] = category
+        elif name == "priority":
+            values[name] = None if category == "Spam" else rng.choice(PRIORITIES)
+        elif name == "is_spam":
+            values[name] = category == "Spam"
+        elif name == "action_items":
+            values[name] = "No action items." if category in ("Newsletter", "Spam") else "- Reply to the sender by Friday"
+        elif name == "summary":
+            values[name] = " ".join(text.split()[:25])
+        elif name == "reply_draft":
+            values[name] = None if category in ("Newsletter", "Spam") else "Hi,\n\nThank you for your email. I will get back to you shortly.\n\nBest regards"
+        elif field.annotation in (bool, Optional[bool]):
+            values[name] = False
+        elif field.annotation in (int, Optional[int], float, Optional[float]):
+            values[name] = 0
+        elif getattr(field.annotation, "__origin__", None) is list:
+            values[name] = []
+        else:
+            values[name] = f"{name} {rng.randint(0, 9999)}"
+    return values
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model answering instantly or after `latency` +/- `jitter` seconds, failing a
+    share `error_rate` of the calls. Structured output is always valid for the schema.
+    """
+
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    seed: int = 0
+
+    _random: random.Random = PrivateAttr(default=None)
+    _lock: Any = PrivateAttr(default=None)
+    _stats: List[dict] = PrivateAttr(default_factory=list)
+
+    def model_post_init(self, __context):
+        self._random = random.Random(self.seed)
+        self._lock = threading.Lock()
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-email-agent"
+
+    @property
+    def stats(self):
+        # one entry per call: latency (wall time of the call), prompt_chars, error
+        with self._lock:
+            return list(self._stats)
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.clear()
+
+    def _wait(self, prompt, started):
+        with self._lock:
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            failed = self._random.random() < self.error_rate
+        time.sleep(delay)
+        if failed:
+            self._record(prompt, started, True)
+            raise FakeLLMError("Simulated model failure (429 Resource exhausted)")
+
+    def _record(self, prompt, started, failed=False):
+        with self._lock:
+            self._stats.append({"latency": time.perf_counter() - started, "prompt_chars": len(prompt), "error": failed})
+
+    def _answer(self, prompt, schema=None):
+        if schema is not None:
+            return json.dumps(fake_fields(schema, prompt))
+        ids = EMAIL_HEADER.findall(prompt)
+        if ids:
+            # multi-email categorization request
+            results = []
+            for email_id in ids:
+                block = prompt.split(f"--- EMAIL {email_id} ---", 1)[1][:2000]
+                results.append({"email_id": email_id, **fake_fields(CategorizedEmail, block)})
+            return json.dumps({"results": results})
+        words = prompt.split()
+        return "Here is what I found: " + " ".join(words[-40:])
+
+    def _tool_call(self, messages, tools):
+        # a fresh question gets one tool call, a question with tool results gets an answer
+        if not tools or not messages or not isinstance(messages[-1], HumanMessage):
+            return None
+        query = messages[-1].text
+        for spec in tools:
+            function = spec.get("function", spec)
+            if "query" in function.get("parameters", {}).get("properties", {}):
+                return {"name": function["name"], "args": {"query": query}, "id": f"call_{_rng(query).randint(0, 10**9)}"}
+        function = tools[0].get("function", tools[0])
+        return {"name": function["name"], "args": {}, "id": f"call_{_rng(query).randint(0, 10**9)}"}
+
+    def _usage(self, prompt, answer):
+        input_tokens = len(prompt) // 4 + 1
+        output_tokens = len(answer) // 4 + 1
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        started = time.perf_counter()
+        prompt = _text(messages)
+        self._wait(prompt, started)
+        call = self._tool_call(messages, kwargs.get("tools"))
+        if call:
+            message = AIMessage(content="", tool_calls=[call], usage_metadata=self._usage(prompt, json.dumps(call)))
+            self._record(prompt, started)
+            return ChatResult(generations=[ChatGeneration(message=message)])
+        answer = self._answer(prompt, kwargs.get("structured_schema"))
+        message = AIMessage(content=answer, usage_metadata=self._usage(prompt, answer))
+        self._record(prompt, started)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        started = time.perf_counter()
+        prompt = _text(messages)
+        self._wait(prompt, started)
+        call = self._tool_call(messages, kwargs.get("tools"))
+        if call:
+            self._record(prompt, started)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(
+                content="", usage_metadata=self._usage(prompt, json.dumps(call)),
+                tool_call_chunks=[{"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": 0}]))
+            yield chunk
+            return
+        answer = self._answer(prompt, kwargs.get("structured_schema"))
+        self._record(prompt, started)
+        tokens = re.findall(r"\S+\s*", answer)
+        for i, token in enumerate(tokens):
+            usage = self._usage(prompt, answer) if i == len(tokens) - 1 else None
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token, usage_metadata=usage))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    def bind_tools(self, tools, **kwargs: Any):
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], **kwargs)
+
+    def with_structured_output(self, schema, *, include_raw: bool = False, **kwargs: Any):
+        # mirrors json_mode: the model answers JSON text which is parsed into `schema`
+        return self.bind(structured_schema=schema) | PydanticOutputParser(pydantic_object=schema)
@@ -0,0 +1,56 @@
+#keeps the chat history sent to the agent bounded: recent turns verbatim, older ones folded into a summary
+
+# messages (user + assistant) kept word for word, older ones are summarized this many at a time
+KEEP_MESSAGES = 6
+# upper bound of the verbatim part, older messages are summarized even inside the window
+HISTORY_TOKEN_BUDGET = 2000
+
+
+def estimate_tokens(text):
+    # rough estimate, good enough for budgets
+    return len(text) // 4 + 1
+
+
+class HistoryManager:
+    def __init__(self, keep_messages: int = KEEP_MESSAGES, token_budget: int = HISTORY_TOKEN_BUDGET):
+        self.keep_messages = keep_messages
+        self.token_budget = token_budget
+        self.summary = ""
+        # number of leading messages already folded into the summary
+        self.summarized = 0
+        self.last_usage = None
+        self.total_usage = {"prompt_tokens": 0, "completion_tokens": 0, "turns": 0}
+
+    def compact(self, chat_history, summarize):
+        """
+        Returns (summary, recent_messages, usage) for `chat_history`. Messages leave the verbatim
+        window in blocks of `keep_messages`, each block is passed to `summarize(summary, messages)`
+        once, together with the current summary; `summarize` returns (summary, usage).
+        `usage` is the token usage of that call, None on the turns that do not summarize.
+        """
+        if len(chat_history) < self.summarized:
+            # the chat was cleared
+            self.summary, self.summarized = "", 0
+
+        # the window grows to 2 * keep_messages - 1 messages, then the oldest block is folded
+        start = self.summarized
+        if len(chat_history) - start >= 2 * self.keep_messages:
+            start = len(chat_history) - self.keep_messages
+        used = sum(estimate_tokens(m["content"]) for m in chat_history[start:])
+        if used > self.token_budget:
+            # folded down to half the budget, so the next turns fit without summarizing again
+            while start < len(chat_history) - 1 and used > self.token_budget // 2:
+                used -= estimate_tokens(chat_history[start]["content"])
+                start += 1
+
+        usage = None
+        if start > self.summarized:
+            self.summary, usage = summarize(self.summary, chat_history[self.summarized:start])
+            self.summarized = start
+        return self.summary, chat_history[start:], usage
+
+    def record(self, usage):
+        self.last_usage = dict(usage)
+        self.total_usage["prompt_tokens"] += usage.get("prompt_tokens", 0)
+        self.total_usage["completion_tokens"] += usage.get("completion_tokens", 0)
+        self.total_usage["turns"] += 1
@@ -0,0 +1,156 @@
+import contextvars
+import threading
+import time
+import traceback
+import uuid
+from collections import Counter, deque
+
+from backend.mailboxes import current_mailbox
+
+#background categorization and drafting jobs, the Streamlit pages poll them instead of blocking
+
+# completed emails kept per job for the live view
+RECENT_RESULTS = 50
+# finished jobs nobody released are kept this many per kind and mailbox, older ones are dropped
+FINISHED_KEPT = 3
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, kind):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.mailbox = current_mailbox()
+        self.status = "queued"
+        self.total = 0
+        self.statuses = {}
+        self.recent = deque(maxlen=RECENT_RESULTS)
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self.lock = threading.Lock()
+
+    # called by the worker
+
+    def start(self, total):
+        # called once per chunk of emails, a streamed inbox grows the total as it is read
+        with self.lock:
+            self.total += total
+
+    def update(self, email_id, status, record=None):
+        with self.lock:
+            self.statuses[str(email_id)] = status
+            if record is not None:
+                self.recent.append(record)
+
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    # called by the UI
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def snapshot(self):
+        with self.lock:
+            counts = Counter(self.statuses.values())
+            return {
+                "id": self.id,
+                "kind": self.kind,
+                "mailbox": self.mailbox,
+                "status": self.status,
+                "total": self.total,
+                "completed": sum(n for status, n in counts.items() if status != "failed"),
+                "failed": counts.get("failed", 0),
+                "counts": dict(counts),
+                "recent": list(self.recent),
+                "error": self.error,
+                "elapsed": (self.finished or time.time()) - self.created,
+            }
+
+
+class JobManager:
+    def __init__(self):
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, kind, target, **kwargs):
+        """
+        Runs `target(job=job, **kwargs)` in a daemon thread, in the mailbox of the caller, and returns the job id.
+        """
+        job = Job(kind)
+        with self.lock:
+            self._prune(kind, job.mailbox)
+            self.jobs[job.id] = job
+
+        def run():
+            job.status = "running"
+            try:
+                target(job=job, **kwargs)
+                job.status = "cancelled" if job.cancelled() else "done"
+            except JobCancelled:
+                job.status = "cancelled"
+            except Exception as e:
+                job.status = "failed"
+                job.error = f"{e}\n{traceback.format_exc()}"
+            finally:
+                job.finished = time.time()
+
+        # the thread sees the caller's context variables, the current mailbox among them
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(run,), name=f"{kind}-{job.id[:8]}", daemon=True).start()
+        return job.id
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def release(self, job_id):
+        """
+        Forgets a finished job once its final state was read, with its per-email statuses.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None and job.status not in ("queued", "running"):
+                del self.jobs[job_id]
+
+    def _prune(self, kind, mailbox):
+        # jobs whose page was closed before they finished are never released
+        finished = sorted((job for job in self.jobs.values()
+                           if job.status not in ("queued", "running") and job.kind == kind and job.mailbox == mailbox),
+                          key=lambda job: job.finished or time.time())
+        for job in finished[:max(0, len(finished) - FINISHED_KEPT)]:
+            del self.jobs[job.id]
+
+    def running(self, kind=None, mailbox=None):
+        with self.lock:
+            return [job for job in self.jobs.values()
+                    if job.status in ("queued", "running") and (kind is None or job.kind == kind)
+                    and (mailbox is None or job.mailbox == mailbox)]
+
+
+jobs = JobManager()
+_start_lock = threading.Lock()
+
+
+def _start(kind, target, **kwargs):
+    # only one job of a kind per mailbox at a time, a second click joins the running one
+    with _start_lock:
+        running = jobs.running(kind, current_mailbox())
+        if running:
+            return running[0].id
+        return jobs.submit(kind, target, **kwargs)
+
+
+def start_categorization(**kwargs):
+    from backend.categorizer import categorizer
+    return _start("categorize", categorizer, **kwargs)
+
+
+def start_drafts(**kwargs):
+    from backend.drafter import bulk_drafts
+    return _start("drafts", bulk_drafts, **kwargs)
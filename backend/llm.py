@@ -0,0 +1,34 @@
+import os
+from backend.metrics import get_callback_handler
+
+#builds the chat models used by the categorizer and the agent, so a fake one can be swapped in
+
+# set EMAIL_AGENT_FAKE_LLM=1 to run everything against backend.fakellm.FakeChatModel
+FAKE_ENV = "EMAIL_AGENT_FAKE_LLM"
+
+_factory = None
+
+
+def set_chat_model_factory(factory):
+    """
+    Makes `factory(**kwargs)` build every chat model from now on, None restores the default.
+    """
+    global _factory
+    _factory = factory
+
+
+def chat_model(**kwargs):
+    # every model call reports its latency, tokens and errors to backend.metrics
+    kwargs.setdefault("callbacks", [get_callback_handler()])
+    if _factory is not None:
+        return _factory(**kwargs)
+    if os.getenv(FAKE_ENV):
+        from backend.fakellm import FakeChatModel
+        return FakeChatModel(
+            latency=float(os.getenv("EMAIL_AGENT_FAKE_LATENCY", "0")),
+            jitter=float(os.getenv("EMAIL_AGENT_FAKE_JITTER", "0")),
+            error_rate=float(os.getenv("EMAIL_AGENT_FAKE_ERROR_RATE", "0")),
+            callbacks=kwargs["callbacks"],
+        )
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(**kwargs)
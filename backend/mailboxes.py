@@ -0,0 +1,147 @@
+import contextvars
+import os
+import re
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+
+#mailbox namespaces: each mailbox keeps its inbox, processed emails, prompts, drafts and caches in its own folder
+
+ROOT = "sources"
+# the default mailbox is sources/ itself, the others are sources/<name>/
+DEFAULT = "default"
+NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$")
+# a folder of sources/ holding one of these is a mailbox
+MARKERS = ("mailbox.db", "inbox.json")
+# metrics counters reported per mailbox by categorize_mailboxes()
+COUNTERS = ("llm_calls", "llm_errors", "prompt_tokens", "completion_tokens", "scheduler_retries")
+
+_current = contextvars.ContextVar("mailbox", default=DEFAULT)
+
+
+def validate(name: str) -> str:
+    if name != DEFAULT and not NAME.match(name or ""):
+        raise ValueError(f"Invalid mailbox name: {name!r} (letters, digits, '.', '_' and '-')")
+    return name
+
+
+def current_mailbox() -> str:
+    return _current.get()
+
+
+def set_mailbox(name: str):
+    """
+    Makes `name` the mailbox of the current thread (and of the jobs it starts).
+    """
+    _current.set(validate(name))
+
+
+@contextmanager
+def use_mailbox(name: str):
+    token = _current.set(validate(name))
+    try:
+        yield name
+    finally:
+        _current.reset(token)
+
+
+def mailbox_dir(name: str | None = None) -> str:
+    name = validate(name or current_mailbox())
+    return ROOT if name == DEFAULT else os.path.join(ROOT, name)
+
+
+def mailbox_path(filename: str, name: str | None = None) -> str:
+    return os.path.join(mailbox_dir(name), filename)
+
+
+def list_mailboxes():
+    """
+    Returns the default mailbox followed by the other mailboxes in sources/, by name.
+    """
+    names = []
+    if os.path.isdir(ROOT):
+        for entry in os.scandir(ROOT):
+            if entry.is_dir() and NAME.match(entry.name) and entry.name != DEFAULT and \
+                    any(os.path.exists(os.path.join(entry.path, marker)) for marker in MARKERS):
+                names.append(entry.name)
+    return [DEFAULT] + sorted(names)
+
+
+def create_mailbox(name: str) -> str:
+    """
+    Creates an empty mailbox whose prompts are a copy of the default mailbox's.
+    """
+    from backend.store import DBFile, get_store
+    os.makedirs(mailbox_dir(validate(name)), exist_ok=True)
+    store = get_store(mailbox_path(DBFile, name))
+    if not store.prompts():
+        prompts = get_store(mailbox_path(DBFile, DEFAULT)).prompts()
+        if prompts:
+            store.save_prompts(prompts)
+    return name
+
+
+# parallel categorization
+
+def _init_worker(cwd, requests_per_minute, max_concurrency):
+    # each worker process gets an even share of the global model call budget
+    os.chdir(cwd)
+    from backend.scheduler import scheduler
+    scheduler.configure(requests_per_minute=requests_per_minute, max_concurrency=max_concurrency,
+                        interactive_reserved=0)
+
+
+def _categorize_mailbox(name, options):
+    from backend.categorizer import categorizer
+    from backend.jobs import Job
+    from backend.metrics import metrics
+    from backend.store import get_store
+    # a worker process runs several mailboxes one after the other, each starts from empty metrics
+    # so the metrics file written into its folder and the counters below are its own
+    metrics.reset()
+    with use_mailbox(name):
+        # the job only collects the per-email outcome for the summary
+        job = Job("categorize")
+        summary = {"status": "ok"}
+        try:
+            categorizer(job=job, **options)
+        except Exception as e:
+            summary.update(status="failed", error=f"{type(e).__name__}: {e}")
+        state = job.snapshot()
+        summary.update(emails=state["total"], results=state["counts"], processed=get_store().count("processed"))
+    counters = metrics.snapshot()["counters"]
+    summary["model"] = {counter: counters.get(counter, 0) for counter in COUNTERS}
+    return summary
+
+
+def categorize_mailboxes(names=None, processes: int | None = None, max_concurrency: int | None = None,
+                         requests_per_minute: float | None = None, **options):
+    """
+    Categorizes every mailbox of `names` (all by default) in a pool of up to `processes` worker
+    processes, one mailbox per process at a time. `max_concurrency` model calls in flight and
+    `requests_per_minute` (EMAIL_AGENT_MAX_CONCURRENCY / EMAIL_AGENT_RPM by default) are totals
+    shared evenly by the processes. `options` are passed to categorizer().
+    Returns {name: {"status", "emails", "results", "processed", "model", "error"}} in the order of `names`.
+    """
+    from backend.scheduler import CONCURRENCY_ENV, MAX_CONCURRENCY, RPM_ENV
+    names = [validate(name) for name in (names or list_mailboxes())]
+    if not names:
+        return {}
+    if max_concurrency is None:
+        max_concurrency = int(os.getenv(CONCURRENCY_ENV, MAX_CONCURRENCY))
+    if requests_per_minute is None and os.getenv(RPM_ENV):
+        requests_per_minute = float(os.getenv(RPM_ENV))
+    # more processes than model call slots would only wait on each other
+    processes = max(1, min(processes or os.cpu_count() or 1, len(names), max_concurrency))
+    share = (requests_per_minute / processes if requests_per_minute else None, max(1, max_concurrency // processes))
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(os.getcwd(), *share)) as pool:
+        futures = {pool.submit(_categorize_mailbox, name, options): name for name in names}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                # the worker process itself died
+                results[futures[future]] = {"status": "failed", "error": f"{type(e).__name__}: {e}\n{traceback.format_exc()}"}
+    return {name: results[name] for name in names}
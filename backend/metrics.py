@@ -0,0 +1,186 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from backend.mailboxes import mailbox_path
+
+#per-stage timings, token usage, retries and failures of the pipeline, exported as Prometheus text or JSONL
+
+# kept in the folder of the current mailbox, see backend.mailboxes
+PROMETHEUS_FILE = "metrics.prom"
+# set EMAIL_AGENT_METRICS_LOG to a path to get one JSON line per stage run and model call
+LOG_ENV = "EMAIL_AGENT_METRICS_LOG"
+# durations kept per stage for the quantiles
+WINDOW = 1024
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stages = defaultdict(lambda: {"count": 0, "seconds": 0.0, "max": 0.0, "failures": 0,
+                                               "recent": deque(maxlen=WINDOW)})
+            self.counters = defaultdict(int)
+
+    def observe(self, name, seconds, failed=False, **fields):
+        with self.lock:
+            stage = self.stages[name]
+            stage["count"] += 1
+            stage["seconds"] += seconds
+            stage["max"] = max(stage["max"], seconds)
+            stage["recent"].append(seconds)
+            if failed:
+                stage["failures"] += 1
+        log = os.getenv(LOG_ENV)
+        if log:
+            event = {"ts": time.time(), "stage": name, "seconds": seconds, "failed": failed, **fields}
+            with self.lock, open(log, "a") as f:
+                f.write(json.dumps(event, default=str) + "\n")
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.observe(name, time.perf_counter() - started, failed=True)
+            raise
+        self.observe(name, time.perf_counter() - started)
+
+    def timed(self, name):
+        # decorator version of stage()
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        """
+        Returns {"stages": {name: {...}}, "counters": {...}} with quantiles computed from the recent durations.
+        """
+        with self.lock:
+            stages = {}
+            for name, stage in self.stages.items():
+                recent = sorted(stage["recent"])
+                stages[name] = {
+                    "count": stage["count"],
+                    "seconds": stage["seconds"],
+                    "mean": stage["seconds"] / stage["count"] if stage["count"] else 0.0,
+                    "p50": recent[int(0.50 * (len(recent) - 1))] if recent else 0.0,
+                    "p95": recent[int(0.95 * (len(recent) - 1))] if recent else 0.0,
+                    "max": stage["max"],
+                    "failures": stage["failures"],
+                }
+            return {"stages": stages, "counters": dict(self.counters)}
+
+    def prometheus(self):
+        snap = self.snapshot()
+        lines = [
+            "# HELP email_agent_stage_seconds Duration of pipeline stages.",
+            "# TYPE email_agent_stage_seconds summary",
+        ]
+        for name, stage in sorted(snap["stages"].items()):
+            lines.append(f'email_agent_stage_seconds{{stage="{name}",quantile="0.5"}} {stage["p50"]:.6f}')
+            lines.append(f'email_agent_stage_seconds{{stage="{name}",quantile="0.95"}} {stage["p95"]:.6f}')
+            lines.append(f'email_agent_stage_seconds_sum{{stage="{name}"}} {stage["seconds"]:.6f}')
+            lines.append(f'email_agent_stage_seconds_count{{stage="{name}"}} {stage["count"]}')
+        lines.append("# HELP email_agent_stage_failures_total Failed runs of pipeline stages.")
+        lines.append("# TYPE email_agent_stage_failures_total counter")
+        for name, stage in sorted(snap["stages"].items()):
+            lines.append(f'email_agent_stage_failures_total{{stage="{name}"}} {stage["failures"]}')
+        lines.append("# HELP email_agent_events_total Token usage, retries and other counted events.")
+        lines.append("# TYPE email_agent_events_total counter")
+        for name, value in sorted(snap["counters"].items()):
+            lines.append(f'email_agent_events_total{{event="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str | None = None):
+        # written atomically so a node exporter never reads half a file, worker processes do not share the temp file
+        path = path or mailbox_path(PROMETHEUS_FILE)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.prometheus())
+        os.replace(tmp, path)
+        return path
+
+
+class MetricsCallbackHandler:
+    """
+    Records the latency, token usage, retries and errors of every model call.
+    Used through get_callback_handler(), which makes it a LangChain callback handler.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.started = {}
+        self.lock = threading.Lock()
+
+    def _start(self, run_id, serialized):
+        name = (serialized or {}).get("name") or "llm"
+        with self.lock:
+            self.started[run_id] = (time.perf_counter(), name)
+
+    def _finish(self, run_id):
+        with self.lock:
+            return self.started.pop(run_id, (None, "llm"))
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, serialized)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, serialized)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started, name = self._finish(run_id)
+        prompt_tokens = completion_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                prompt_tokens += usage.get("input_tokens", 0)
+                completion_tokens += usage.get("output_tokens", 0)
+        self.registry.increment("llm_calls")
+        self.registry.increment("prompt_tokens", prompt_tokens)
+        self.registry.increment("completion_tokens", completion_tokens)
+        if started is not None:
+            self.registry.observe("llm.call", time.perf_counter() - started, model=name,
+                                  prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        started, name = self._finish(run_id)
+        self.registry.increment("llm_errors")
+        if started is not None:
+            self.registry.observe("llm.call", time.perf_counter() - started, failed=True, model=name, error=str(error))
+
+    def on_retry(self, retry_state, *, run_id, **kwargs):
+        self.registry.increment("llm_retries")
+
+
+metrics = Metrics()
+_callback_handler = None
+
+
+def get_callback_handler():
+    # LangChain is only imported once a model is built, so the headless commands start fast
+    global _callback_handler
+    if _callback_handler is None:
+        from langchain_core.callbacks import BaseCallbackHandler
+
+        class LangChainMetricsHandler(MetricsCallbackHandler, BaseCallbackHandler):
+            pass
+
+        _callback_handler = LangChainMetricsHandler(metrics)
+    return _callback_handler
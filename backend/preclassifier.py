@@ -0,0 +1,150 @@
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+from backend.retrieval import tokenize
+from backend.structure import CategorizedEmail
+
+#local first stage of the categorizer: obvious newsletters and spam are labelled without a model call
+
+# emails classified at least this confident skip the LLM
+CONFIDENCE_THRESHOLD = 0.9
+# only categories that need no summary, action items or reply from the model can be decided locally
+FAST_CATEGORIES = ("Newsletter", "Spam")
+# below this many labelled emails the statistical model is not used, only the sender rules
+MIN_TRAINING_EMAILS = 20
+# the fields of a processed email the model is trained on, emails labelled here are left out
+TRAINING_FIELDS = ("sender", "subject", "body", "category", "preclassified")
+# a rule alone stays below CONFIDENCE_THRESHOLD, it decides an email only when the trained model agrees
+RULE_CONFIDENCE = 0.75
+
+AUTOMATED_SENDER = re.compile(
+    r"^(no-?reply|do-?not-?reply|newsletters?|news|digest|weekly-digest|notifications?|updates|mailer-daemon|marketing)[@+.-]",
+    re.IGNORECASE)
+SPAM_SUBJECT = re.compile(r"(you('ve| have)? won|lottery|claim your (prize|reward|gift)|free gift|act now)", re.IGNORECASE)
+
+
+def _features(email):
+    sender = str(email.get("sender") or "")
+    local, _, domain = sender.partition("@")
+    words = tokenize(f"{email.get('subject') or ''} {str(email.get('body') or '')[:2000]}")
+    return words + [f"sender:{local.lower()}", f"domain:{domain.lower()}"]
+
+
+class NaiveBayes:
+    # multinomial naive Bayes with Laplace smoothing
+
+    def __init__(self):
+        self.class_counts = Counter()
+        self.term_counts = defaultdict(Counter)
+        self.totals = Counter()
+        self.vocabulary = set()
+
+    def fit(self, documents, labels):
+        for features, label in zip(documents, labels):
+            self.add(features, label)
+        return self
+
+    def add(self, features, label):
+        self.class_counts[label] += 1
+        self.term_counts[label].update(features)
+        self.totals[label] += len(features)
+        self.vocabulary.update(features)
+
+    def predict_proba(self, features):
+        n = sum(self.class_counts.values())
+        if not n:
+            return {}
+        v = len(self.vocabulary) or 1
+        scores = {}
+        for label, count in self.class_counts.items():
+            score = math.log(count / n)
+            counts, total = self.term_counts[label], self.totals[label]
+            for feature in features:
+                score += math.log((counts[feature] + 1) / (total + v))
+            scores[label] = score
+        top = max(scores.values())
+        exp = {label: math.exp(score - top) for label, score in scores.items()}
+        norm = sum(exp.values())
+        return {label: value / norm for label, value in exp.items()}
+
+
+def rule_category(email):
+    """
+    Returns (category, confidence) from sender and subject rules, or (None, 0).
+    """
+    if SPAM_SUBJECT.search(str(email.get("subject") or "")):
+        return "Spam", RULE_CONFIDENCE
+    if AUTOMATED_SENDER.search(str(email.get("sender") or "")):
+        return "Newsletter", RULE_CONFIDENCE
+    return None, 0.0
+
+
+class PreClassifier:
+    def __init__(self, threshold: float = CONFIDENCE_THRESHOLD):
+        self.threshold = threshold
+        self.model = None
+
+    def train(self, processed):
+        # `processed` may be a stream of emails, only the term counts are kept
+        model = NaiveBayes()
+        for email in processed:
+            # its own labels would only reinforce its mistakes
+            if email.get("category") and not email.get("preclassified"):
+                model.add(_features(email), email["category"])
+        trained = sum(model.class_counts.values()) >= MIN_TRAINING_EMAILS and len(model.class_counts) > 1
+        self.model = model if trained else None
+        return self
+
+    def predict(self, email):
+        """
+        Returns (category, confidence), combining the sender rules with the trained model.
+        """
+        category, confidence = rule_category(email)
+        if self.model is not None:
+            probabilities = self.model.predict_proba(_features(email))
+            if probabilities:
+                learned = max(probabilities, key=probabilities.get)
+                if category is None or learned == category:
+                    # agreeing signals reinforce each other
+                    confidence = 1 - (1 - confidence) * (1 - probabilities[learned])
+                    category = learned
+                else:
+                    # the model disagrees with the rule, trust the rule less
+                    confidence *= probabilities.get(category, 0.0) / probabilities[learned]
+        return category, confidence
+
+    def classify(self, email):
+        """
+        Returns a CategorizedEmail when the email is an obvious newsletter or spam, None otherwise.
+        """
+        category, confidence = self.predict(email)
+        if category not in FAST_CATEGORIES or confidence < self.threshold:
+            return None
+        return CategorizedEmail(
+            category=category,
+            priority=None if category == "Spam" else "Low",
+            is_spam=category == "Spam",
+            action_items="No action items.",
+            summary=f"{category}: {email.get('subject') or 'No Subject'}",
+            reply_draft=None,
+        )
+
+
+_trained = {}
+_lock = threading.Lock()
+
+
+def get_preclassifier(version, loader, threshold: float = CONFIDENCE_THRESHOLD):
+    """
+    Returns a PreClassifier trained on `loader()`, retrained only when the data `version` changes.
+    """
+    with _lock:
+        cached = _trained.get("model")
+        if cached is None or cached[0] != version:
+            _trained["model"] = (version, PreClassifier().train(loader()))
+        model = _trained["model"][1]
+    classifier = PreClassifier(threshold)
+    classifier.model = model.model
+    return classifier
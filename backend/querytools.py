@@ -0,0 +1,215 @@
+import json
+import threading
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+
+import numpy as np
+from langchain.tools import tool
+
+from backend.emailtable import get_email_table
+from backend.retrieval import get_index, tokenize, TOP_K
+from backend.store import get_store
+from backend.metrics import metrics
+
+#tools the Email Agent calls to look up processed emails, answered from in-memory indexes built once per data version
+
+MAX_RESULTS = 25
+# characters of summary / action items / body returned per email
+SNIPPET_CHARS = 300
+BODY_CHARS = 4000
+
+
+def _groups(series):
+    # {value: [positions]} of a categorical column
+    codes = series.cat.codes.to_numpy()
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(series.cat.categories) + 1))
+    return {str(value): order[bounds[i]:bounds[i + 1]].tolist()
+            for i, value in enumerate(series.cat.categories) if bounds[i] < bounds[i + 1]}
+
+
+class QueryIndex:
+    """
+    Lookup tables over the processed inbox (an EmailTable): sender (address, local part and name words),
+    category, priority, date and action item deadline.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        frame = table.frame
+        self.by_id = {str(email_id): position for position, email_id in enumerate(frame["id"].tolist())}
+        self.by_sender = defaultdict(set)
+        self.by_category = defaultdict(set)
+        self.by_priority = defaultdict(set)
+        # categorical columns are indexed once per distinct value, not per email
+        for address, positions in _groups(frame["sender"]).items():
+            address = address.lower()
+            for key in (address, address.partition("@")[0]):
+                self.by_sender[key].update(positions)
+        for name, positions in _groups(frame["sender_name"]).items():
+            for key in tokenize(name):
+                self.by_sender[key].update(positions)
+        for value, positions in _groups(frame["category"]).items():
+            self.by_category[value.lower()].update(positions)
+        for value, positions in _groups(frame["priority"]).items():
+            self.by_priority[value.lower()].update(positions)
+        timestamps = frame["timestamp"].fillna("").to_numpy(dtype=object)
+        order = np.argsort(timestamps, kind="stable")
+        self.dates = [t[:10] for t in timestamps[order]]
+        self.dated = order.tolist()
+        # position -> rank by timestamp, for newest-first results
+        self.recency = np.empty(len(frame), dtype=int)
+        self.recency[order] = np.arange(len(frame))
+        # the earliest task deadline of each email, parsed when the email was stored (see backend.tasks)
+        deadlines = table.store.task_deadlines()
+        due = sorted((deadlines[key], position) for position, key in enumerate(table.keys) if key in deadlines)
+        self.deadlines = [d for d, _ in due]
+        self.due = [p for _, p in due]
+        self.deadline_of = {p: d for d, p in due}
+
+    def __len__(self):
+        return len(self.table)
+
+    def values(self, field):
+        table = self.by_category if field == "category" else self.by_priority
+        return sorted(key for key, positions in table.items() if key and positions)
+
+    def _range(self, keys, positions, start, end):
+        lo = bisect_left(keys, start) if start else 0
+        hi = bisect_right(keys, end) if end else len(keys)
+        return set(positions[lo:hi])
+
+    def query(self, sender=None, category=None, priority=None, since=None, until=None,
+              due_after=None, due_before=None, limit: int = 10):
+        """
+        Returns the emails matching every given filter, newest first, or by deadline when a due filter is given.
+        Dates are YYYY-MM-DD and inclusive.
+        """
+        candidates = []
+        if sender:
+            address = sender.strip().lower()
+            # a full address matches as is, a name needs every word to match ("Lisa Chen")
+            for word in [address] if address in self.by_sender else tokenize(sender) or [address]:
+                candidates.append(self.by_sender.get(word, set()))
+        if category:
+            candidates.append(self.by_category.get(category.strip().lower(), set()))
+        if priority:
+            candidates.append(self.by_priority.get(priority.strip().lower(), set()))
+        if since or until:
+            candidates.append(self._range(self.dates, self.dated, since, until))
+        by_deadline = bool(due_after or due_before)
+        if by_deadline:
+            candidates.append(self._range(self.deadlines, self.due, due_after, due_before))
+        if candidates:
+            # intersect starting from the smallest set
+            candidates.sort(key=len)
+            matches = set(candidates[0]).intersection(*candidates[1:])
+        else:
+            matches = range(len(self.table))
+        if by_deadline:
+            ordered = sorted(matches, key=lambda p: self.deadline_of[p])
+        else:
+            ordered = sorted(matches, key=self.recency.__getitem__, reverse=True)
+        return [self.row(p) for p in ordered[:max(1, min(limit, MAX_RESULTS))]]
+
+    def row(self, position, body: bool = False):
+        # the body is read from the store, only for get_email
+        email = self.table.email(position) if body else self.table.record(position)
+        row = {
+            "id": email.get("id"),
+            "sender": email.get("sender"),
+            "sender_name": email.get("sender_name"),
+            "subject": email.get("subject"),
+            "date": str(email.get("timestamp") or "")[:10],
+            "category": email.get("category"),
+            "priority": email.get("priority"),
+            "deadline": self.deadline_of.get(position),
+            "summary": str(email.get("summary") or "")[:SNIPPET_CHARS],
+            "action_items": str(email.get("action_items") or "")[:SNIPPET_CHARS],
+        }
+        if body:
+            row["body"] = str(email.get("body") or "")[:BODY_CHARS]
+            row["recipients"] = email.get("recipients")
+            row["attachment_names"] = email.get("attachment_names")
+        return row
+
+    def get(self, email_id):
+        position = self.by_id.get(str(email_id))
+        return None if position is None else self.row(position, body=True)
+
+
+# database path -> QueryIndex, one per mailbox
+_query_indexes = {}
+_query_lock = threading.Lock()
+
+
+def get_query_index():
+    """
+    Returns the QueryIndex of the current mailbox, rebuilt only when its EmailTable changed.
+    """
+    table = get_email_table()
+    with _query_lock:
+        index = _query_indexes.get(table.store.path)
+        if index is None or index.table is not table:
+            with metrics.stage("agent.query_index_build"):
+                index = _query_indexes[table.store.path] = QueryIndex(table)
+    return index
+
+
+def _dump(result):
+    return json.dumps(result, default=str, ensure_ascii=False)
+
+
+@tool
+def find_emails(sender: str | None = None, category: str | None = None, priority: str | None = None,
+                since: str | None = None, until: str | None = None,
+                due_after: str | None = None, due_before: str | None = None, limit: int = 10) -> str:
+    """Find processed emails matching all the given filters.
+
+    Args:
+        sender: sender name or email address, e.g. "Lisa" or "lisa@company.com"
+        category: email category, e.g. "To-Do" or "Meeting Request"
+        priority: "High", "Medium" or "Low"
+        since: only emails sent on or after this date (YYYY-MM-DD)
+        until: only emails sent on or before this date (YYYY-MM-DD)
+        due_after: only emails whose action items are due on or after this date (YYYY-MM-DD)
+        due_before: only emails whose action items are due on or before this date (YYYY-MM-DD)
+        limit: maximum number of emails to return
+    """
+    with metrics.stage("agent.tool.find_emails"):
+        return _dump(get_query_index().query(sender, category, priority, since, until, due_after, due_before, limit))
+
+
+@tool
+def search_emails(query: str, limit: int = TOP_K) -> str:
+    """Full-text search of processed emails by topic or keywords, best matches first.
+
+    Args:
+        query: words to look for in subjects, senders, summaries and action items
+        limit: maximum number of emails to return
+    """
+    with metrics.stage("agent.tool.search_emails"):
+        from backend.agent import extract_info
+        store = get_store()
+        index = get_index(store.version("processed"), extract_info, store.path)
+        lookup = get_query_index()
+        rows = []
+        for email in index.search(query, k=max(1, min(limit, MAX_RESULTS))):
+            position = lookup.by_id.get(str(email.get("id")))
+            if position is not None:
+                rows.append(lookup.row(position))
+        return _dump(rows)
+
+
+@tool
+def get_email(email_id: str) -> str:
+    """Get the full details of one email, including its body, by the id returned by the other tools.
+
+    Args:
+        email_id: the "id" of the email
+    """
+    with metrics.stage("agent.tool.get_email"):
+        return _dump(get_query_index().get(email_id) or {"error": f"No email with id {email_id}"})
+
+
+TOOLS = [find_emails, search_emails, get_email]
@@ -0,0 +1,44 @@
+import threading
+import time
+
+#simple token bucket shared by the worker threads so we stay under the quota
+
+
+class TokenBucket:
+    def __init__(self, requests_per_minute: float, burst: int | None = None):
+        if requests_per_minute <= 0:
+            raise ValueError("requests_per_minute must be positive")
+        self.rate = requests_per_minute / 60.0
+        self.capacity = float(burst if burst else max(1, int(requests_per_minute // 60)))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        """
+        Takes one request if possible and returns 0, otherwise returns the seconds until one is available.
+        """
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def set_rate(self, requests_per_minute: float):
+        with self.lock:
+            self._refill()
+            self.rate = requests_per_minute / 60.0
+
+    def acquire(self):
+        # blocks until one request can be made
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
@@ -0,0 +1,76 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+#opt-in cache of agent answers for repeated questions about the same email
+
+TTL_SECONDS = 15 * 60
+MAX_ENTRIES = 256
+# only the most recent messages of the chat are part of the key
+HISTORY_WINDOW = 6
+
+
+def _hash(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def normalize_query(query):
+    return " ".join(str(query).lower().split())
+
+
+def make_key(user_query, chat_history, selected_email, prompts, data_version=None):
+    # without a selected email the answer depends on the whole processed inbox, hence `data_version`
+    email_part = data_version
+    if selected_email:
+        email_part = (selected_email.get("id"), _hash(selected_email))
+    history = [(m.get("role"), m.get("content")) for m in chat_history[-HISTORY_WINDOW:]]
+    return _hash([normalize_query(user_query), email_part, _hash(prompts or {}), history])
+
+
+class ResponseCache:
+    def __init__(self, ttl: float = TTL_SECONDS, max_entries: int = MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self.entries),
+            }
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+#in-process BM25 index over the processed inbox, so the agent only sees the emails relevant to a query
+
+FIELDS = ("subject", "sender", "sender_name", "summary", "action_items")
+TOP_K = 8
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "have", "i", "in",
+    "is", "it", "me", "my", "of", "on", "or", "that", "the", "this", "to", "was", "what",
+    "when", "which", "who", "with", "you", "your", "any", "about", "there", "do", "does",
+}
+
+TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return [t for t in TOKEN.findall(str(text).lower()) if t not in STOPWORDS]
+
+
+def _doc_key(email):
+    # an edited email gets a new key, so an update is a remove plus an add
+    return hashlib.sha1(json.dumps(email, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class EmailIndex:
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs = {}
+        self.lengths = {}
+        self.postings = defaultdict(dict)
+        self.total_length = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def _add(self, key, email):
+        terms = Counter()
+        for field in FIELDS:
+            terms.update(tokenize(email.get(field) or ""))
+        self.docs[key] = email
+        self.lengths[key] = sum(terms.values())
+        self.total_length += self.lengths[key]
+        for term, tf in terms.items():
+            self.postings[term][key] = tf
+
+    def _remove(self, key):
+        email = self.docs.pop(key)
+        self.total_length -= self.lengths.pop(key)
+        for field in FIELDS:
+            for term in set(tokenize(email.get(field) or "")):
+                posting = self.postings.get(term)
+                if posting is not None:
+                    posting.pop(key, None)
+                    if not posting:
+                        del self.postings[term]
+
+    def sync(self, emails):
+        """
+        Brings the index in line with `emails`, only touching the ones that were added,
+        changed or removed since the last sync.
+        """
+        keyed = {_doc_key(email): email for email in emails}
+        with self.lock:
+            for key in [k for k in self.docs if k not in keyed]:
+                self._remove(key)
+            for key, email in keyed.items():
+                if key not in self.docs:
+                    self._add(key, email)
+
+    def search(self, query, k: int = TOP_K):
+        terms = set(tokenize(query))
+        with self.lock:
+            n = len(self.docs)
+            if not n or not terms:
+                return []
+            avgdl = self.total_length / n or 1
+            scores = defaultdict(float)
+            for term in terms:
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+                for key, tf in posting.items():
+                    norm = 1 - self.b + self.b * self.lengths[key] / avgdl
+                    scores[key] += idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+            best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+            return [self.docs[key] for key, _ in best]
+
+    def recent(self, k: int = TOP_K):
+        # fallback for questions that match no indexed term, e.g. "summarize my inbox"
+        with self.lock:
+            emails = sorted(self.docs.values(), key=lambda e: str(e.get("timestamp") or ""), reverse=True)
+        return emails[:k]
+
+
+# namespace (a mailbox) -> [index, version]
+_indexes = {}
+_index_lock = threading.Lock()
+
+
+def get_index(version, loader, namespace=None):
+    """
+    Returns the shared index of `namespace`, re-syncing it with `loader()` when the data `version` changed.
+    """
+    with _index_lock:
+        entry = _indexes.setdefault(namespace, [EmailIndex(), None])
+        if version != entry[1]:
+            entry[0].sync(loader())
+            entry[1] = version
+    return entry[0]
@@ -0,0 +1,229 @@
+import heapq
+import itertools
+import os
+import random
+import re
+import threading
+import time
+
+from backend.metrics import metrics
+from backend.ratelimit import TokenBucket
+
+#process-wide gate for every model call: quota, priority lanes, retries with backoff and a circuit breaker
+
+# lower runs first: chat turns jump ahead of queued batch work
+INTERACTIVE = 0
+BATCH = 1
+LANE_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+# EMAIL_AGENT_RPM sizes the token bucket to the API quota, unset means no request rate limit
+RPM_ENV = "EMAIL_AGENT_RPM"
+CONCURRENCY_ENV = "EMAIL_AGENT_MAX_CONCURRENCY"
+MAX_CONCURRENCY = 8
+# slots batch work can never take, so a chat turn does not wait for a batch call to finish
+INTERACTIVE_RESERVED = 1
+MAX_ATTEMPTS = 5
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+# consecutive throttled or failed calls that open the circuit, and how long it stays open
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30.0
+
+RETRYABLE = re.compile(r"\b(429|500|502|503|504)\b|resource.?exhausted|rate.?limit|quota|unavailable|overloaded|"
+                       r"deadline.?exceeded|timed? ?out|temporar", re.IGNORECASE)
+RETRY_AFTER = re.compile(r"retry(?:[ _-]?after|[ _-]?delay|\s+in)['\"]?\s*[:=]?\s*['\"]?\s*(\d+(?:\.\d+)?)\s*(ms|s)?",
+                         re.IGNORECASE)
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+def is_retryable(error):
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    return bool(RETRYABLE.search(f"{type(error).__name__} {error}"))
+
+
+def retry_after(error):
+    """
+    Returns the delay in seconds the server asked for, from a Retry-After header or the error text, or None.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = getattr(error, "retry_after", None) or headers.get("retry-after") or headers.get("Retry-After")
+    if value is not None:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            pass
+    match = RETRY_AFTER.search(str(error))
+    if match:
+        return float(match[1]) / (1000 if match[2] and match[2].lower() == "ms" else 1)
+    return None
+
+
+class Scheduler:
+    """
+    Admits model calls in priority order, within `max_concurrency` calls at a time and the
+    `requests_per_minute` quota. Throttled calls are retried with jittered exponential backoff
+    (or the server's retry-after), and the rate is halved until calls succeed again.
+    After `failure_threshold` consecutive failures calls fail fast for `reset_timeout` seconds.
+    """
+
+    def __init__(self, requests_per_minute: float | None = None, max_concurrency: int = MAX_CONCURRENCY,
+                 max_attempts: int = MAX_ATTEMPTS, base_delay: float = BASE_DELAY, max_delay: float = MAX_DELAY,
+                 failure_threshold: int = FAILURE_THRESHOLD, reset_timeout: float = RESET_TIMEOUT):
+        self.requests_per_minute = requests_per_minute
+        self.bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.rate = requests_per_minute
+        self.max_concurrency = max(1, max_concurrency)
+        self.interactive_reserved = INTERACTIVE_RESERVED
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.condition = threading.Condition()
+        self.queue = []
+        self.sequence = itertools.count()
+        self.active = 0
+        self.paused_until = 0.0
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.random = random.Random()
+
+    @classmethod
+    def from_env(cls):
+        rpm = os.getenv(RPM_ENV)
+        return cls(requests_per_minute=float(rpm) if rpm else None,
+                   max_concurrency=int(os.getenv(CONCURRENCY_ENV, MAX_CONCURRENCY)))
+
+    def configure(self, requests_per_minute: float | None = None, max_concurrency: int | None = None,
+                  interactive_reserved: int | None = None):
+        """
+        Replaces the quota and the concurrency cap, e.g. in a worker process given a share of a global budget.
+        """
+        with self.condition:
+            self.requests_per_minute = self.rate = requests_per_minute
+            self.bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+            if max_concurrency is not None:
+                self.max_concurrency = max(1, max_concurrency)
+            if interactive_reserved is not None:
+                self.interactive_reserved = interactive_reserved
+            self.condition.notify_all()
+
+    # admission
+
+    def _circuit_allows(self, now):
+        if self.opened_at is None:
+            return True
+        if now - self.opened_at < self.reset_timeout or self.probing:
+            return False
+        # half open: a single call finds out whether the API is back
+        self.probing = True
+        return True
+
+    def _acquire(self, lane):
+        ticket = (lane, next(self.sequence))
+        started = time.perf_counter()
+        with self.condition:
+            heapq.heappush(self.queue, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if self.opened_at is not None and now - self.opened_at < self.reset_timeout:
+                        raise CircuitOpenError(f"Model calls paused for {self.reset_timeout - (now - self.opened_at):.0f}s "
+                                               f"after {self.failures} consecutive failures")
+                    limit = self.max_concurrency - (self.interactive_reserved if lane == BATCH and self.max_concurrency > 1 else 0)
+                    wait = None
+                    # the heap orders by lane first, a batch call only goes when no chat turn is queued
+                    if self.queue[0] == ticket and self.active < limit:
+                        if now < self.paused_until:
+                            wait = self.paused_until - now
+                        elif self._circuit_allows(now):
+                            wait = self.bucket.try_acquire() if self.bucket else 0.0
+                            if not wait:
+                                heapq.heappop(self.queue)
+                                self.active += 1
+                                # the next call in line may be admitted too
+                                self.condition.notify_all()
+                                break
+                            self.probing = False
+                    self.condition.wait(wait)
+            except BaseException:
+                self.queue.remove(ticket)
+                heapq.heapify(self.queue)
+                self.condition.notify_all()
+                raise
+        metrics.observe(f"scheduler.wait.{LANE_NAMES.get(lane, lane)}", time.perf_counter() - started)
+
+    def _release(self, succeeded, delay=0.0):
+        # succeeded is None for errors that say nothing about the API health, like a bad request
+        with self.condition:
+            self.active -= 1
+            self.probing = False
+            if succeeded:
+                self.failures = 0
+                self.opened_at = None
+                if self.bucket and self.rate < self.requests_per_minute:
+                    # additive increase back towards the quota
+                    self.rate = min(self.requests_per_minute, self.rate + max(1.0, self.requests_per_minute / 10))
+                    self.bucket.set_rate(self.rate)
+            elif succeeded is not None:
+                self.failures += 1
+                # every lane waits out the server's cool-down, and the rate backs off
+                self.paused_until = max(self.paused_until, time.monotonic() + delay)
+                if self.bucket:
+                    self.rate = max(1.0, self.rate / 2)
+                    self.bucket.set_rate(self.rate)
+                if self.failures >= self.failure_threshold:
+                    if self.opened_at is None:
+                        metrics.increment("scheduler_circuit_opened")
+                    self.opened_at = time.monotonic()
+            self.condition.notify_all()
+
+    def backoff(self, attempt):
+        # full jitter keeps workers that failed together from retrying together
+        return self.random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, fn, lane: int = BATCH):
+        """
+        Runs `fn()` once admitted and returns its result, retrying throttled and transient failures.
+        """
+        for attempt in range(self.max_attempts):
+            self._acquire(lane)
+            try:
+                result = fn()
+            except Exception as error:
+                if not is_retryable(error):
+                    self._release(None)
+                    raise
+                hinted = retry_after(error)
+                delay = min(self.max_delay, hinted) if hinted is not None else self.backoff(attempt)
+                # only a server hint pauses everyone, a plain backoff is per call
+                self._release(False, delay=delay if hinted is not None else 0.0)
+                metrics.increment("scheduler_retries")
+                if attempt == self.max_attempts - 1:
+                    raise
+                time.sleep(delay)
+                continue
+            self._release(True)
+            return result
+
+    def stats(self):
+        with self.condition:
+            return {
+                "active": self.active,
+                "queued": {LANE_NAMES[lane]: sum(1 for t in self.queue if t[0] == lane) for lane in LANE_NAMES},
+                "requests_per_minute": self.rate,
+                "circuit_open": self.opened_at is not None,
+                "consecutive_failures": self.failures,
+            }
+
+
+scheduler = Scheduler.from_env()
@@ -0,0 +1,547 @@
+import json
+import os
+import sqlite3
+import threading
+from backend.datacache import file_signature, invalidate
+from backend.mailboxes import mailbox_path
+from backend.tasks import PARSER_VERSION, fingerprint, task_rows
+
+#SQLite backed mailbox storage, the JSON files next to the database are imported on change and can be exported back
+
+# file names inside the folder of a mailbox (see backend.mailboxes)
+DBFile = "mailbox.db"
+
+JSON_FILES = {
+    "inbox": "inbox.json",
+    "processed": "processed_inbox.json",
+    "prompts": "prompts.json",
+    "drafts": "drafts.json",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS inbox (
+    key TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    sender TEXT,
+    timestamp TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS inbox_position ON inbox(position);
+CREATE INDEX IF NOT EXISTS inbox_sender ON inbox(sender);
+CREATE INDEX IF NOT EXISTS inbox_timestamp ON inbox(timestamp);
+
+CREATE TABLE IF NOT EXISTS processed (
+    key TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    category TEXT,
+    priority TEXT,
+    sender TEXT,
+    timestamp TEXT,
+    is_spam INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS processed_position ON processed(position);
+CREATE INDEX IF NOT EXISTS processed_category ON processed(category);
+CREATE INDEX IF NOT EXISTS processed_priority ON processed(priority);
+CREATE INDEX IF NOT EXISTS processed_sender ON processed(sender);
+CREATE INDEX IF NOT EXISTS processed_timestamp ON processed(timestamp);
+
+CREATE TABLE IF NOT EXISTS prompts (
+    key TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    value TEXT
+);
+
+CREATE TABLE IF NOT EXISTS drafts (
+    key TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    related_email_id TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS drafts_related ON drafts(related_email_id);
+
+CREATE TABLE IF NOT EXISTS tasks (
+    email_key TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    deadline TEXT,
+    email_id TEXT,
+    sender TEXT,
+    sender_name TEXT,
+    subject TEXT,
+    PRIMARY KEY (email_key, number)
+);
+CREATE INDEX IF NOT EXISTS tasks_deadline ON tasks(deadline);
+CREATE INDEX IF NOT EXISTS tasks_sender ON tasks(sender, deadline);
+
+CREATE TABLE IF NOT EXISTS task_sources (
+    email_key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+EMAIL_TABLES = ("inbox", "processed")
+# fields copied out of the JSON into their own column on write
+INDEXED = {"inbox": ("sender", "timestamp"), "processed": ("category", "priority", "sender", "timestamp", "is_spam")}
+
+
+def _keys(records):
+    # ids are supposed to be unique but older processed files repeat them, keep every row anyway
+    seen = set()
+    keys = []
+    for position, record in enumerate(records):
+        key = str(record.get("id", position))
+        if key in seen:
+            key = f"{key}#{position}"
+        seen.add(key)
+        keys.append(key)
+    return keys
+
+
+class MailboxStore:
+    def __init__(self, path: str, json_files: dict | None = None):
+        self.path = path
+        if json_files is None:
+            # the JSON files of the mailbox sit next to its database
+            folder = os.path.dirname(os.path.abspath(path))
+            json_files = {table: os.path.join(folder, name) for table, name in JSON_FILES.items()}
+        self.json_files = {table: os.path.abspath(path) for table, path in json_files.items()}
+        self.local = threading.local()
+        self.write_lock = threading.Lock()
+        self.conn().executescript(SCHEMA)
+        self._backfill_tasks()
+
+    # connections
+
+    def conn(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            # autocommit mode, transactions are opened explicitly by _Transaction
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def transaction(self):
+        return _Transaction(self)
+
+    def signature(self, table):
+        # changes whenever the database or the JSON file behind `table` is written, see backend.datacache
+        return file_signature(self.path, self.path + "-wal", self.json_files.get(table) or "")
+
+    def version(self, table):
+        # bumped on every write to `table`, used by readers to know when to refresh
+        self.sync(table)
+        row = self.conn().execute("SELECT value FROM meta WHERE name = ?", (f"version:{table}",)).fetchone()
+        return int(row["value"]) if row else 0
+
+    def _bump(self, conn, table):
+        conn.execute(
+            "INSERT INTO meta(name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+            (f"version:{table}",))
+
+    # JSON import / export
+
+    def _file_stamp(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+    def sync(self, table):
+        """
+        Imports the JSON file of `table` when it changed since it was last imported or exported.
+        """
+        path = self.json_files.get(table)
+        stamp = self._file_stamp(path) if path else None
+        if stamp is None:
+            return
+        row = self.conn().execute("SELECT value FROM meta WHERE name = ?", (f"import:{table}",)).fetchone()
+        if row and row["value"] == stamp:
+            return
+        self.import_json(table, path)
+
+    def import_json(self, table, path):
+        with open(path, "r") as f:
+            raw = json.load(f)
+        if table == "inbox" and isinstance(raw, dict):
+            raw = raw.get("emails", [])
+        stamp = self._file_stamp(path) if os.path.abspath(path) == self.json_files.get(table) else None
+        if table == "prompts":
+            self._save_prompts(raw, _stamp=stamp)
+        elif table == "drafts":
+            self._replace_drafts(raw, _stamp=stamp)
+        else:
+            self._replace_emails(table, raw, _stamp=stamp)
+
+    def export_json(self, table, path: str | None = None):
+        path = os.path.abspath(path or self.json_files[table])
+        if table == "prompts":
+            data = self.prompts()
+        elif table == "drafts":
+            data = self.drafts()
+        elif table == "inbox":
+            data = {"emails": self.emails("inbox")}
+        else:
+            data = self.emails(table)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f, indent=4)
+        os.replace(tmp, path)
+        if path == self.json_files.get(table):
+            # our own export must not be imported back as a change
+            with self.transaction() as conn:
+                self._record_import(conn, table, self._file_stamp(path))
+
+    def _record_import(self, conn, table, stamp):
+        if stamp:
+            conn.execute("INSERT OR REPLACE INTO meta(name, value) VALUES (?, ?)", (f"import:{table}", stamp))
+
+    # emails
+
+    def _email_row(self, table, key, position, email):
+        data = json.dumps(email)
+        if table == "inbox":
+            return (key, position, email.get("sender"), email.get("timestamp"), data)
+        return (key, position, email.get("category"), email.get("priority"), email.get("sender"),
+                email.get("timestamp"), int(bool(email.get("is_spam"))), data)
+
+    def _upsert_sql(self, table):
+        if table == "inbox":
+            return ("INSERT INTO inbox(key, position, sender, timestamp, data) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET position = excluded.position, sender = excluded.sender, "
+                    "timestamp = excluded.timestamp, data = excluded.data "
+                    "WHERE inbox.data != excluded.data OR inbox.position != excluded.position")
+        return ("INSERT INTO processed(key, position, category, priority, sender, timestamp, is_spam, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET position = excluded.position, category = excluded.category, "
+                "priority = excluded.priority, sender = excluded.sender, timestamp = excluded.timestamp, "
+                "is_spam = excluded.is_spam, data = excluded.data "
+                "WHERE processed.data != excluded.data OR processed.position != excluded.position")
+
+    def upsert_emails(self, table, emails, start: int | None = None):
+        """
+        Inserts or updates `emails` by id without touching the other rows.
+        New rows are appended after the existing ones unless `start` is given.
+        """
+        if table not in EMAIL_TABLES:
+            raise ValueError(f"Unknown email table: {table}")
+        # pending edits of the JSON file go in first, otherwise they would overwrite this write later
+        self.sync(table)
+        append = start is None
+        with self.transaction() as conn:
+            if append:
+                start = conn.execute(f"SELECT COALESCE(MAX(position) + 1, 0) FROM {table}").fetchone()[0]
+            rows = []
+            for offset, email in enumerate(emails):
+                key = str(email.get("id", start + offset))
+                existing = conn.execute(f"SELECT position FROM {table} WHERE key = ?", (key,)).fetchone()
+                # an email that is already stored keeps its place when appending
+                position = existing["position"] if existing and append else start + offset
+                rows.append(self._email_row(table, key, position, email))
+            conn.executemany(self._upsert_sql(table), rows)
+            if table == "processed":
+                self._update_tasks(conn, [(row[0], email) for row, email in zip(rows, emails)])
+            self._bump(conn, table)
+
+    def _replace_emails(self, table, emails, _stamp=None):
+        emails = list(emails)
+        keys = _keys(emails)
+        with self.transaction() as conn:
+            conn.executemany(self._upsert_sql(table),
+                             [self._email_row(table, key, i, email) for i, (key, email) in enumerate(zip(keys, emails))])
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS keep_keys (key TEXT PRIMARY KEY)")
+            conn.execute("DELETE FROM keep_keys")
+            conn.executemany("INSERT OR IGNORE INTO keep_keys(key) VALUES (?)", [(k,) for k in keys])
+            conn.execute(f"DELETE FROM {table} WHERE key NOT IN (SELECT key FROM keep_keys)")
+            if table == "processed":
+                conn.execute("DELETE FROM tasks WHERE email_key NOT IN (SELECT key FROM keep_keys)")
+                conn.execute("DELETE FROM task_sources WHERE email_key NOT IN (SELECT key FROM keep_keys)")
+                self._update_tasks(conn, list(zip(keys, emails)))
+            self._record_import(conn, table, _stamp)
+            self._bump(conn, table)
+
+    def replace_emails(self, table, emails):
+        """
+        Makes `table` hold exactly `emails`, upserting changed rows and dropping the missing ones.
+        """
+        if table not in EMAIL_TABLES:
+            raise ValueError(f"Unknown email table: {table}")
+        self.sync(table)
+        self._replace_emails(table, emails)
+
+    def _where(self, category=None, priority=None, sender=None, since=None, until=None, is_spam=None, search=None):
+        clauses, params = [], []
+        if search:
+            clauses.append("(sender LIKE ? OR json_extract(data, '$.subject') LIKE ? OR json_extract(data, '$.sender_name') LIKE ?)")
+            params += [f"%{search}%"] * 3
+        for column, value in (("category", category), ("priority", priority), ("sender", sender)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("timestamp < ?")
+            params.append(until)
+        if is_spam is not None:
+            clauses.append("is_spam = ?")
+            params.append(int(is_spam))
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def emails(self, table, limit: int | None = None, offset: int = 0, **filters):
+        """
+        Returns the emails of `table` in inbox order. `filters` are any of category, priority,
+        sender, since, until (timestamps), is_spam and search (subject / sender substring);
+        only the processed table has category, priority and is_spam.
+        """
+        self.sync(table)
+        where, params = self._where(**filters)
+        sql = f"SELECT data FROM {table}{where} ORDER BY position"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [limit, offset]
+        return [json.loads(row["data"]) for row in self.conn().execute(sql, params)]
+
+    def columns(self, table, fields):
+        """
+        Returns {"key": [...], field: [...]} for `fields` of every email of `table` in inbox order.
+        The fields are read out of the stored JSON by SQLite, so bodies never reach Python;
+        list fields come back as JSON text.
+        """
+        rows = self._select_fields(table, fields).fetchall()
+        values = list(zip(*rows)) if rows else [()] * (len(fields) + 1)
+        return dict(zip(("key", *fields), (list(v) for v in values)))
+
+    def iter_fields(self, table, fields):
+        """
+        Yields {field: value} for `fields` of every email of `table` in inbox order, one row at a time,
+        so a table of any size is read without holding it in memory.
+        """
+        for row in self._select_fields(table, fields):
+            yield dict(zip(fields, tuple(row)[1:]))
+
+    def _select_fields(self, table, fields):
+        self.sync(table)
+        indexed = INDEXED.get(table, ())
+        selected = ", ".join(field if field in indexed else f"json_extract(data, '$.{field}')" for field in fields)
+        return self.conn().execute(f"SELECT key, {selected} FROM {table} ORDER BY position")
+
+    def get_emails(self, table, keys):
+        """
+        Returns the full emails stored under `keys`, in that order, skipping missing ones.
+        """
+        self.sync(table)
+        keys = [str(key) for key in keys]
+        found = {}
+        # stays under SQLite's limit of bound parameters
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            sql = f"SELECT key, data FROM {table} WHERE key IN ({', '.join('?' * len(chunk))})"
+            found.update((row["key"], json.loads(row["data"])) for row in self.conn().execute(sql, chunk))
+        return [found[key] for key in keys if key in found]
+
+    def count(self, table, **filters):
+        self.sync(table)
+        where, params = self._where(**filters)
+        return self.conn().execute(f"SELECT COUNT(*) FROM {table}{where}", params).fetchone()[0]
+
+    def distinct(self, table, column):
+        if column not in ("category", "priority", "sender"):
+            raise ValueError(f"Not an indexed column: {column}")
+        self.sync(table)
+        rows = self.conn().execute(f"SELECT DISTINCT {column} FROM {table} WHERE {column} IS NOT NULL ORDER BY {column}")
+        return [row[0] for row in rows]
+
+    # tasks
+
+    def _update_tasks(self, conn, keyed):
+        """
+        Reparses the action items of the (key, email) pairs whose task fields changed.
+        """
+        changed = []
+        for start in range(0, len(keyed), 500):
+            chunk = keyed[start:start + 500]
+            known = dict(conn.execute(
+                f"SELECT email_key, fingerprint FROM task_sources WHERE email_key IN ({', '.join('?' * len(chunk))})",
+                [key for key, _ in chunk]).fetchall())
+            for key, email in chunk:
+                digest = fingerprint(email)
+                if known.get(key) != digest:
+                    changed.append((key, email, digest))
+        if not changed:
+            return
+        conn.executemany("DELETE FROM tasks WHERE email_key = ?", [(key,) for key, _, _ in changed])
+        conn.executemany("INSERT OR REPLACE INTO tasks(email_key, number, text, deadline, email_id, sender, sender_name, subject) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         [row for key, email, _ in changed for row in task_rows(key, email)])
+        conn.executemany("INSERT OR REPLACE INTO task_sources(email_key, fingerprint) VALUES (?, ?)",
+                         [(key, digest) for key, _, digest in changed])
+
+    def _backfill_tasks(self):
+        row = self.conn().execute("SELECT value FROM meta WHERE name = 'tasks:parser'").fetchone()
+        if row is None or row["value"] != str(PARSER_VERSION):
+            # tasks parsed by an older parser are all parsed again below
+            with self.transaction() as conn:
+                conn.execute("DELETE FROM tasks")
+                conn.execute("DELETE FROM task_sources")
+                conn.execute("INSERT OR REPLACE INTO meta(name, value) VALUES ('tasks:parser', ?)", (str(PARSER_VERSION),))
+                # the deadlines read by the query tools and the task views changed
+                self._bump(conn, "processed")
+        # processed emails stored before the tasks table existed, or whose tasks were dropped above
+        missing = self.conn().execute(
+            "SELECT key, data FROM processed WHERE key NOT IN (SELECT email_key FROM task_sources)").fetchall()
+        if missing:
+            with self.transaction() as conn:
+                self._update_tasks(conn, [(row["key"], json.loads(row["data"])) for row in missing])
+
+    def tasks(self, due: str | None = None, before: str | None = None, after: str | None = None,
+              sender: str | None = None, dated: bool | None = None, limit: int | None = None):
+        """
+        Returns the tasks of the processed emails ({"text", "deadline", "email_id", "sender",
+        "sender_name", "subject"}), by deadline with the undated ones last. Dates are YYYY-MM-DD:
+        `due` on that day, `after` on or after it, `before` strictly before it; `dated` keeps only
+        the tasks with (True) or without (False) a deadline.
+        """
+        self.sync("processed")
+        clauses, params = [], []
+        for clause, value in (("deadline = ?", due), ("deadline < ?", before), ("deadline >= ?", after), ("sender = ?", sender)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        if dated is not None:
+            clauses.append("deadline IS NOT NULL" if dated else "deadline IS NULL")
+        where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+        sql = (f"SELECT text, deadline, email_id, sender, sender_name, subject FROM tasks{where} "
+               "ORDER BY deadline IS NULL, deadline, email_key, number")
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [dict(row) for row in self.conn().execute(sql, params)]
+
+    def task_senders(self):
+        """
+        Returns [{"sender", "sender_name", "tasks", "next_deadline"}] of everyone who sent a task, most tasks first.
+        """
+        self.sync("processed")
+        rows = self.conn().execute(
+            "SELECT sender, MAX(sender_name) AS sender_name, COUNT(*) AS tasks, MIN(deadline) AS next_deadline "
+            "FROM tasks GROUP BY sender ORDER BY tasks DESC, sender")
+        return [dict(row) for row in rows]
+
+    def task_deadlines(self):
+        """
+        Returns {email key: earliest task deadline} of the processed emails that have a dated task.
+        """
+        self.sync("processed")
+        rows = self.conn().execute("SELECT email_key, MIN(deadline) FROM tasks WHERE deadline IS NOT NULL GROUP BY email_key")
+        return dict(rows.fetchall())
+
+    # prompts
+
+    def prompts(self):
+        self.sync("prompts")
+        return {row["key"]: row["value"] for row in self.conn().execute("SELECT key, value FROM prompts ORDER BY position")}
+
+    def save_prompts(self, prompts: dict):
+        self.sync("prompts")
+        self._save_prompts(prompts)
+
+    def _save_prompts(self, prompts: dict, _stamp=None):
+        # the prompts are always saved as a whole
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM prompts")
+            conn.executemany("INSERT INTO prompts(key, position, value) VALUES (?, ?, ?)",
+                             [(key, i, value) for i, (key, value) in enumerate(prompts.items())])
+            self._record_import(conn, "prompts", _stamp)
+            self._bump(conn, "prompts")
+
+    # drafts
+
+    def drafts(self, related_email_id: str | None = None):
+        self.sync("drafts")
+        sql, params = "SELECT data FROM drafts", []
+        if related_email_id is not None:
+            sql += " WHERE related_email_id = ?"
+            params.append(related_email_id)
+        return [json.loads(row["data"]) for row in self.conn().execute(sql + " ORDER BY position", params)]
+
+    def save_drafts(self, drafts):
+        """
+        Upserts `drafts` in a single transaction.
+        """
+        self.sync("drafts")
+        with self.transaction() as conn:
+            start = conn.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM drafts").fetchone()[0]
+            conn.executemany(
+                "INSERT INTO drafts(key, position, related_email_id, data) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET related_email_id = excluded.related_email_id, data = excluded.data",
+                [(draft["id"], start + i, draft.get("related_email_id"), json.dumps(draft)) for i, draft in enumerate(drafts)])
+            self._bump(conn, "drafts")
+
+    def save_draft(self, draft):
+        self.save_drafts([draft])
+
+    def delete_draft(self, draft_id):
+        self.sync("drafts")
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM drafts WHERE key = ?", (draft_id,))
+            self._bump(conn, "drafts")
+
+    def _replace_drafts(self, drafts, _stamp=None):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM drafts")
+            conn.executemany(
+                "INSERT OR REPLACE INTO drafts(key, position, related_email_id, data) VALUES (?, ?, ?, ?)",
+                [(draft["id"], i, draft.get("related_email_id"), json.dumps(draft)) for i, draft in enumerate(drafts)])
+            self._record_import(conn, "drafts", _stamp)
+            self._bump(conn, "drafts")
+
+
+class _Transaction:
+    # serializes writers of this process and commits or rolls back as one unit
+
+    def __init__(self, store):
+        self.store = store
+
+    def __enter__(self):
+        self.store.write_lock.acquire()
+        self.conn = self.store.conn()
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.conn.commit()
+                invalidate(self.store.path)
+            else:
+                self.conn.rollback()
+        finally:
+            self.store.write_lock.release()
+        return False
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path: str | None = None):
+    # one store per database file and process, connections are opened per thread
+    # without a path, the store of the current mailbox (see backend.mailboxes)
+    path = os.path.abspath(path or mailbox_path(DBFile))
+    with _stores_lock:
+        if path not in _stores:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _stores[path] = MailboxStore(path)
+        return _stores[path]
@@ -17,4 +17,21 @@ class Email(BaseModel):
     action_items: Optional[str] = Field(None,description="Any actions / tasks to be taken by the user given in the email.")
     summary : Optional[str] = Field(...,description="A short summary of the email.")
     has_attachment: Optional[bool] = Field(False,description="Does the email contain any attachment.")
-    attachment_names: Optional[List[str]] = Field(None,description="The names of the attachments in the email.")
\ No newline at end of file
+    attachment_names: Optional[List[str]] = Field(None,description="The names of the attachments in the email.")
+    reply_draft: Optional[str] = Field(None,description="Auto generated reply draft for the email.")
+    preclassified: Optional[bool] = Field(False,description="Labelled by the local preclassifier, not by the model.")
+
+
+class CategorizedEmail(BaseModel):
+    # only the fields the model has to generate, everything else is copied from the inbox record
+    category: Optional[str] = Field(None, description="Category of the email.")
+    priority: Optional[str] = Field(None,description="The priority / importance of the email.")
+    is_spam: Optional[bool] = Field(False,description="Is the email a spam or not.")
+    action_items: Optional[str] = Field(None,description="Any actions / tasks to be taken by the user given in the email.")
+    summary : Optional[str] = Field(None,description="A short summary of the email.")
+    reply_draft: Optional[str] = Field(None,description="Drafted reply to the email, empty for spam and noreply senders.")
+
+
+def merge_result(email: dict, result: CategorizedEmail) -> Email:
+    # the ids, body and timestamps always come from the original record
+    return Email(**{**email, **result.model_dump()})
\ No newline at end of file
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import re
+from datetime import date, timedelta
+
+from backend.deadlines import parse_deadline
+
+#turns the action items of processed emails into task records, kept by the store in a table ordered by deadline
+
+# action items that mean there is nothing to do
+NO_TASKS = re.compile(r"^\W*(none|n/?a|nothing|no (action items?|actions?|tasks?)( (required|needed|found))?)\W*$",
+                      re.IGNORECASE)
+# "1. ...", "2) ...", "- ...", "* ...", "• ...", "- [ ] ..."
+LIST_ITEM = re.compile(r"^\s*(?:(?:\d+[.)]|[-*•])\s+)?(?:\[[ xX]?\]\s+)?(.*\S)")
+FENCE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$", re.IGNORECASE)
+# keys of a task object in the JSON answer asked for by the action item prompt
+TEXT_KEYS = ("task", "text", "description", "title", "action")
+UPCOMING_DAYS = 7
+# raised whenever parsing changes, stores built by an older parser rebuild their tasks when opened
+PARSER_VERSION = 2
+
+
+def fingerprint(email):
+    # the fields task records are made of, a task is only reparsed when one of them changed
+    parts = [email.get(field) for field in ("id", "action_items", "timestamp", "sender", "sender_name", "subject")]
+    return hashlib.sha1(json.dumps(parts, default=str).encode("utf-8")).hexdigest()
+
+
+def _json_tasks(text):
+    """
+    Returns ([(task text, deadline text)], deadline text of all tasks) of a JSON answer, None when it is not JSON.
+    """
+    text = FENCE.sub("", text)
+    if text[:1] not in ("[", "{"):
+        return None
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None
+    shared = None
+    if isinstance(data, dict):
+        shared = data.get("deadline")
+        data = data.get("tasks") or data.get("action_items") or []
+    if not isinstance(data, list):
+        data = [data]
+    tasks = []
+    for item in data:
+        if isinstance(item, dict):
+            text = next((str(item[key]) for key in TEXT_KEYS if item.get(key)), "")
+            tasks.append((text, item.get("deadline")))
+        elif item:
+            tasks.append((str(item), None))
+    return tasks, shared
+
+
+def parse_tasks(action_items, reference=None):
+    """
+    Returns [{"text", "deadline"}] for the action items of an email: the JSON tasks asked for by
+    the action item prompt, or else one task per line (numbered and bulleted lists included). A task without a date of its own is due when the action items as a whole are;
+    relative dates are resolved against `reference` (the email timestamp). Deadlines are YYYY-MM-DD or None.
+    """
+    if not isinstance(action_items, str) or not action_items.strip() or NO_TASKS.match(action_items):
+        return []
+    parsed = _json_tasks(action_items.strip())
+    if parsed is not None:
+        items, shared = parsed
+        overall = parse_deadline(shared, reference) if isinstance(shared, str) else None
+    else:
+        # one task per line, list markers removed; headings like "Questionnaire for team:" are not tasks
+        lines = [LIST_ITEM.sub(r"\1", line).strip() for line in action_items.splitlines()]
+        items = [(line, None) for line in lines if line and not line.endswith(":")]
+        overall = parse_deadline(action_items, reference)
+    tasks = []
+    for text, deadline in items:
+        text = text.strip()
+        if not text or NO_TASKS.match(text):
+            continue
+        due = parse_deadline(deadline, reference) if isinstance(deadline, str) else None
+        due = due or parse_deadline(text, reference) or overall
+        tasks.append({"text": text, "deadline": due.isoformat() if due else None})
+    return tasks
+
+
+def task_rows(key, email):
+    """
+    Returns the rows of the tasks table for the processed email stored under `key`.
+    """
+    return [(key, number, task["text"], task["deadline"], str(email.get("id")), email.get("sender"),
+             email.get("sender_name"), email.get("subject"))
+            for number, task in enumerate(parse_tasks(email.get("action_items"), email.get("timestamp")))]
+
+
+# views, answered from the deadline index of the store
+
+def due_today(store, today: date | None = None):
+    return store.tasks(due=(today or date.today()).isoformat())
+
+
+def overdue(store, today: date | None = None):
+    return store.tasks(before=(today or date.today()).isoformat())
+
+
+def upcoming(store, days: int = UPCOMING_DAYS, today: date | None = None):
+    today = today or date.today()
+    return store.tasks(after=(today + timedelta(days=1)).isoformat(), before=(today + timedelta(days=days + 1)).isoformat())
+
+
+def by_sender(store, sender: str):
+    return store.tasks(sender=sender)
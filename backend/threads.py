@@ -0,0 +1,179 @@
+import hashlib
+import re
+
+from backend.retrieval import tokenize
+
+#groups reply chains and near-duplicate emails, so the categorizer sends each group to the model once
+
+# bodies at most this many SimHash bits apart are near duplicates
+SIMHASH_DISTANCE = 3
+# shorter bodies ("Thanks!", "See you there") are too common to be treated as duplicates
+MIN_DUPLICATE_TOKENS = 20
+# the conversation sent for a thread keeps its latest messages within this size
+MAX_THREAD_CHARS = 12000
+
+REPLY_PREFIX = re.compile(r"^\s*((re|fw|fwd|aw|sv|wg)\s*(\[\d+\])?\s*:\s*)+", re.IGNORECASE)
+MESSAGE_ID = re.compile(r"<[^<>\s]+>")
+QUOTE_HEADER = re.compile(
+    r"^\s*(on .{0,200}wrote:|-{2,}\s*original message\s*-{2,}|-{2,}\s*forwarded message\s*-{2,}|from:\s.+)\s*$",
+    re.IGNORECASE)
+BANDS = 4
+
+
+def strip_quoted(body: str) -> str:
+    """
+    Returns `body` without the quoted history of earlier messages.
+    """
+    lines = []
+    for line in str(body or "").splitlines():
+        if QUOTE_HEADER.match(line):
+            # everything below "On ... wrote:" or an Outlook header is the previous message
+            break
+        if line.lstrip().startswith(">"):
+            continue
+        lines.append(line)
+    return "\n".join(lines).strip()
+
+
+def normalize_subject(subject: str) -> str:
+    return " ".join(REPLY_PREFIX.sub("", str(subject or "")).lower().split())
+
+
+def simhash(text: str, bits: int = 64) -> int:
+    # word 3-gram shingles, so reordered boilerplate still differs from the original
+    tokens = tokenize(text)
+    shingles = [" ".join(tokens[i:i + 3]) for i in range(max(1, len(tokens) - 2))] if tokens else []
+    weights = [0] * bits
+    for shingle in shingles:
+        h = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=bits // 8).digest(), "big")
+        for bit in range(bits):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    return sum(1 << bit for bit in range(bits) if weights[bit] > 0)
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class _UnionFind:
+    def __init__(self, n):
+        self.parent = list(range(n))
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            self.parent[max(a, b)] = min(a, b)
+
+
+def _message_ids(value):
+    if isinstance(value, (list, tuple)):
+        value = " ".join(str(v) for v in value)
+    return MESSAGE_ID.findall(str(value or ""))
+
+
+def _address(value):
+    return str(value or "").strip().lower()
+
+
+def _wrote_to(a, b):
+    # `a` was sent to the sender of `b`
+    sender = _address(b.get("sender"))
+    return bool(sender) and sender in {_address(r) for r in a.get("recipients") or []}
+
+
+def group_emails(emails, max_distance: int = SIMHASH_DISTANCE):
+    """
+    Returns lists of positions in `emails`: members of one thread or near-duplicate cluster share a list.
+    Threads come from message_id and the in_reply_to / references fields; replies without them join
+    an email with the same subject (minus Re:/Fwd:) when one of the two was sent to the other's sender.
+    Sharing a recipient is not enough: every email of an inbox is addressed to its owner.
+    """
+    groups = _UnionFind(len(emails))
+
+    by_message_id = {}
+    for i, email in enumerate(emails):
+        for message_id in _message_ids(email.get("message_id")):
+            by_message_id.setdefault(message_id, i)
+    by_subject = {}
+    for i, email in enumerate(emails):
+        linked = False
+        for parent in _message_ids(email.get("in_reply_to")) + _message_ids(email.get("references")):
+            if parent in by_message_id:
+                groups.union(i, by_message_id[parent])
+                linked = True
+        subject = normalize_subject(email.get("subject"))
+        if not subject:
+            continue
+        if not linked and REPLY_PREFIX.match(str(email.get("subject") or "")):
+            for j in by_subject.get(subject, []):
+                if _wrote_to(email, emails[j]) or _wrote_to(emails[j], email):
+                    groups.union(i, j)
+                    break
+        by_subject.setdefault(subject, []).append(i)
+
+    # near duplicates: two hashes within max_distance bits agree on at least one of BANDS bands
+    by_body = {}
+    by_hash = {}
+    buckets = {}
+    band_bits = 64 // BANDS
+    for i, email in enumerate(emails):
+        body = strip_quoted(email.get("body"))
+        if body not in by_body:
+            by_body[body] = simhash(body) if len(tokenize(body)) >= MIN_DUPLICATE_TOKENS else None
+        h = by_body[body]
+        if h is None:
+            continue
+        # exact duplicates join the first email with the same hash, only distinct hashes go in the buckets,
+        # so a large cluster of copies costs one lookup per copy
+        if h in by_hash:
+            groups.union(i, by_hash[h])
+            continue
+        by_hash[h] = i
+        for band in range(BANDS):
+            key = (band, h >> (band * band_bits) & ((1 << band_bits) - 1))
+            for other, j in buckets.get(key, []):
+                if groups.find(i) != groups.find(j) and hamming(h, other) <= max_distance:
+                    groups.union(i, j)
+            buckets.setdefault(key, []).append((h, i))
+
+    members = {}
+    for i in range(len(emails)):
+        members.setdefault(groups.find(i), []).append(i)
+    return list(members.values())
+
+
+def representative(emails, group, max_distance: int = SIMHASH_DISTANCE):
+    """
+    Returns the record sent to the model for `group`: its latest email, with the body replaced by the
+    conversation (quoted history stripped, near-duplicate messages once) when the group has several members.
+    """
+    ordered = sorted(group, key=lambda i: (str(emails[i].get("timestamp") or ""), i))
+    latest = emails[ordered[-1]]
+    if len(group) == 1:
+        return latest
+    parts, seen, bodies = [], [], set()
+    for i in ordered:
+        body = strip_quoted(emails[i].get("body"))
+        if body in bodies:
+            # exact copies are skipped without hashing them again
+            continue
+        bodies.add(body)
+        h = simhash(body)
+        if any(hamming(h, other) <= max_distance for other in seen):
+            continue
+        seen.append(h)
+        email = emails[i]
+        parts.append(f"From: {email.get('sender_name') or email.get('sender')} ({email.get('timestamp')})\n{body}")
+    conversation = ""
+    # the latest messages matter most, older ones are dropped first
+    for part in reversed(parts):
+        if conversation and len(conversation) + len(part) > MAX_THREAD_CHARS:
+            break
+        conversation = part + ("\n\n" + conversation if conversation else "")
+    return {**latest, "body": conversation}
@@ -0,0 +1,20 @@
+from datetime import date
+
+from backend.deadlines import parse_deadline
+
+SENT = "2024-11-18T09:00:00Z"
+
+
+def test_words_starting_like_a_month_are_not_dates():
+    assert parse_deadline("Update the 2 decks by EOD Friday", SENT) == date(2024, 11, 22)
+    assert parse_deadline("Review the marketing 2 proposals", SENT) is None
+    assert parse_deadline("Send maybe 5 slides", SENT) is None
+    assert parse_deadline("Hire junior 2 engineers", SENT) is None
+
+
+def test_month_names_and_abbreviations():
+    assert parse_deadline("Submit by November 21", SENT) == date(2024, 11, 21)
+    assert parse_deadline("Due Nov. 25", SENT) == date(2024, 11, 25)
+    assert parse_deadline("Renew by 3rd of Jan", SENT) == date(2025, 1, 3)
+    assert parse_deadline("Report was due Sept 3", SENT) == date(2024, 9, 3)
+    assert parse_deadline("Launch on Dec 2, 2024", SENT) == date(2024, 12, 2)
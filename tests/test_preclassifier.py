@@ -0,0 +1,33 @@
+from backend.preclassifier import MIN_TRAINING_EMAILS, PreClassifier
+
+
+def _email(sender, subject, body="", **fields):
+    return {"sender": sender, "subject": subject, "body": body, **fields}
+
+
+def _labelled(n):
+    newsletters = [_email(f"news@shop{i}.com", f"Weekly deals {i}", "Unsubscribe here. This week's offers and discounts.",
+                          category="Newsletter") for i in range(n)]
+    work = [_email(f"colleague{i}@company.com", f"Project sync {i}", "Can we meet tomorrow about the release plan?",
+                   category="Meeting Request") for i in range(n)]
+    return newsletters + work
+
+
+def test_rules_alone_do_not_skip_the_model():
+    classifier = PreClassifier()
+    for email in (_email("cto@company.com", "Hackathon winner announcement"),
+                  _email("boss@company.com", "We closed the deal!!!"),
+                  _email("updates@company.com", "Action required: rotate your credentials by Friday"),
+                  _email("news@company.com", "All-hands moved to 3pm")):
+        assert classifier.classify(email) is None
+
+
+def test_rule_decides_when_the_trained_model_agrees():
+    classifier = PreClassifier().train(_labelled(MIN_TRAINING_EMAILS))
+    result = classifier.classify(_email("news@shop99.com", "Weekly deals", "Unsubscribe here. This week's offers."))
+    assert result is not None and result.category == "Newsletter"
+
+
+def test_preclassified_emails_are_not_trained_on():
+    emails = [{**email, "preclassified": True} for email in _labelled(MIN_TRAINING_EMAILS)]
+    assert PreClassifier().train(emails).model is None
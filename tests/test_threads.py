@@ -0,0 +1,48 @@
+import time
+
+from backend.threads import group_emails
+
+OWNER = "me@company.com"
+BODY = ("Our quarterly newsletter covers the product roadmap, the new office opening, hiring plans, "
+        "customer stories, upcoming webinars, the results of the engineering survey and the holiday schedule "
+        "for every regional team in detail.")
+
+
+def _email(i, sender, subject, body="", recipients=(OWNER,)):
+    return {"id": f"email_{i}", "message_id": f"<{i}@example.com>", "sender": sender,
+            "recipients": list(recipients), "subject": subject, "body": body}
+
+
+def _duplicates(n):
+    return [_email(i, f"news{i}@example.com", f"Newsletter {i}", BODY) for i in range(n)]
+
+
+def test_reply_joins_the_email_it_answers():
+    emails = [_email(0, "alice@example.com", "Budget", "Numbers attached."),
+              _email(1, "bob@example.com", "Re: Budget", "Looks good.", recipients=("alice@example.com", OWNER))]
+    assert group_emails(emails) == [[0, 1]]
+
+
+def test_same_subject_from_unrelated_senders_stays_apart():
+    # both are only addressed to the owner of the inbox, neither answers the other
+    emails = [_email(0, "alice@example.com", "Budget", "Numbers attached."),
+              _email(1, "bob@example.com", "Re: Budget", "Our own budget, unrelated.")]
+    assert sorted(group_emails(emails)) == [[0], [1]]
+
+
+def test_duplicate_cluster_is_one_group():
+    assert group_emails(_duplicates(500)) == [list(range(500))]
+
+
+def test_large_duplicate_cluster_is_linear():
+    def seconds(n):
+        emails = _duplicates(n)
+        start = time.perf_counter()
+        group_emails(emails)
+        return time.perf_counter() - start
+
+    seconds(100)
+    small, large = seconds(1000), seconds(4000)
+    # comparing every copy with every earlier one would take about 16 times as long
+    assert large < max(small, 0.05) * 8
+    assert large < 2.0